@@ -64,4 +64,9 @@ CREATE TABLE IF NOT EXISTS content.person_film_work (
 
 CREATE UNIQUE INDEX IF NOT EXISTS film_work_genre ON content.genre_film_work (film_work_id, genre_id);
 CREATE UNIQUE INDEX IF NOT EXISTS film_work_person_role ON content.person_film_work (film_work_id, person_id, role);
-
+CREATE INDEX IF NOT EXISTS film_work_updated_at_id ON content.film_work (updated_at, id);
+CREATE INDEX IF NOT EXISTS genre_updated_at_id ON content.genre (updated_at, id);
+CREATE INDEX IF NOT EXISTS person_updated_at_id ON content.person (updated_at, id);
+CREATE INDEX IF NOT EXISTS person_film_work_person ON content.person_film_work (person_id, film_work_id);
+CREATE INDEX IF NOT EXISTS genre_film_work_genre ON content.genre_film_work (genre_id, film_work_id);
+CREATE INDEX IF NOT EXISTS film_work_title_id_idx ON content.film_work (title, id);
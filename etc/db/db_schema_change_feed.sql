@@ -0,0 +1,97 @@
+-- Журнал изменений (outbox) для ETL. Триггеры пишут в него каждое изменение таблиц
+-- контента, включая удаления и изменения таблиц связей, и уведомляют ETL через NOTIFY.
+-- ETL вычитывает журнал пачками и удаляет обработанные записи после загрузки в elasticSearch.
+--
+-- Журнал ведется, только пока его включил ETL (content.change_feed_settings.enabled): без
+-- читателя записи не удалялись бы. Записи старше retention удаляются самими триггерами
+-- независимо от ETL, например если ETL, включивший журнал, давно не запускался.
+
+CREATE TABLE IF NOT EXISTS content.change_feed_settings (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    enabled boolean NOT NULL DEFAULT false,
+    channel TEXT NOT NULL DEFAULT 'content_changes',
+    retention INTERVAL NOT NULL DEFAULT '7 days'
+);
+
+INSERT INTO content.change_feed_settings DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS content.change_log (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    object_id uuid NOT NULL,
+    film_work_id uuid,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- object_id - id измененной строки, для таблиц связей - id персоналии или жанра;
+-- film_work_id заполняется для таблиц связей и указывает на затронутое кинопроизведение.
+
+CREATE INDEX IF NOT EXISTS change_log_created_at ON content.change_log (created_at);
+
+-- Канал уведомлений (change_feed.channel в конфиге ETL) тоже берется из настроек.
+-- Устаревшие записи удаляются примерно раз на 1000 записей журнала.
+
+CREATE OR REPLACE FUNCTION content.log_change() RETURNS trigger AS $$
+DECLARE
+    settings content.change_feed_settings;
+    last_id bigint;
+BEGIN
+    SELECT * INTO settings FROM content.change_feed_settings;
+    IF NOT FOUND OR NOT settings.enabled THEN
+        RETURN NULL;
+    END IF;
+    IF TG_TABLE_NAME = 'person_film_work' THEN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO content.change_log (table_name, operation, object_id, film_work_id)
+            VALUES (TG_TABLE_NAME, TG_OP, OLD.person_id, OLD.film_work_id);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO content.change_log (table_name, operation, object_id, film_work_id)
+            VALUES (TG_TABLE_NAME, TG_OP, NEW.person_id, NEW.film_work_id);
+        END IF;
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO content.change_log (table_name, operation, object_id, film_work_id)
+            VALUES (TG_TABLE_NAME, TG_OP, OLD.genre_id, OLD.film_work_id);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO content.change_log (table_name, operation, object_id, film_work_id)
+            VALUES (TG_TABLE_NAME, TG_OP, NEW.genre_id, NEW.film_work_id);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO content.change_log (table_name, operation, object_id)
+        VALUES (TG_TABLE_NAME, TG_OP, OLD.id);
+    ELSE
+        INSERT INTO content.change_log (table_name, operation, object_id)
+        VALUES (TG_TABLE_NAME, TG_OP, NEW.id);
+    END IF;
+    last_id := currval(pg_get_serial_sequence('content.change_log', 'id'));
+    IF last_id % 1000 = 0 THEN
+        DELETE FROM content.change_log WHERE created_at < now() - settings.retention;
+    END IF;
+    -- Одинаковые уведомления в одной транзакции Postgres схлопывает в одно.
+    PERFORM pg_notify(settings.channel, TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS film_work_change_log ON content.film_work;
+CREATE TRIGGER film_work_change_log AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.log_change();
+
+DROP TRIGGER IF EXISTS genre_change_log ON content.genre;
+CREATE TRIGGER genre_change_log AFTER INSERT OR UPDATE OR DELETE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.log_change();
+
+DROP TRIGGER IF EXISTS person_change_log ON content.person;
+CREATE TRIGGER person_change_log AFTER INSERT OR UPDATE OR DELETE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.log_change();
+
+DROP TRIGGER IF EXISTS genre_film_work_change_log ON content.genre_film_work;
+CREATE TRIGGER genre_film_work_change_log AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.log_change();
+
+DROP TRIGGER IF EXISTS person_film_work_change_log ON content.person_film_work;
+CREATE TRIGGER person_film_work_change_log AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.log_change();
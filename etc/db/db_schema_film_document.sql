@@ -0,0 +1,130 @@
+-- Готовые документы кинопроизведений: фильм вместе с жанрами и персоналиями по ролям одной
+-- строкой jsonb. Документ имеет формат индекса film в elasticSearch, его читают ETL
+-- (extract_mode = stored) и API фильмов вместо соединения пяти таблиц. Триггеры пересобирают
+-- документы затронутых фильмов в той же транзакции, что и изменение; updated_at документа
+-- меняется, только если его содержимое действительно изменилось. Пустые списки имеют ту же
+-- форму, что и в запросах ETL (postgres_to_es/utils/queries.py): '{}' для имен, '[]' для объектов.
+
+CREATE TABLE IF NOT EXISTS content.film_work_document (
+    id uuid PRIMARY KEY,
+    document jsonb NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS film_work_document_updated_at_id ON content.film_work_document (updated_at, id);
+
+-- Пересборка документов кинопроизведений ids. Строки фильмов сначала блокируются: в READ COMMITTED
+-- следующий запрос функции получает новый снимок и видит изменения связей, которые конкурентная
+-- транзакция закоммитила, пока эта ждала блокировку, поэтому последний записанный документ
+-- не теряет чужих изменений. Документы удаленных фильмов удаляются.
+
+CREATE OR REPLACE FUNCTION content.refresh_film_work_documents(ids uuid[]) RETURNS void AS $$
+BEGIN
+    PERFORM 1 FROM content.film_work WHERE id = ANY(ids) ORDER BY id FOR NO KEY UPDATE;
+
+    DELETE FROM content.film_work_document d
+    WHERE d.id = ANY(ids) AND NOT EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = d.id);
+
+    INSERT INTO content.film_work_document AS d (id, document, updated_at)
+    SELECT
+        fw.id,
+        jsonb_build_object(
+            'id', fw.id,
+            'rating', fw.rating,
+            'type', fw.type,
+            'title', fw.title,
+            'description', fw.description,
+            'creation_date', fw.creation_date,
+            'genres_names', COALESCE(fg.names, '{}'),
+            'directors_names', COALESCE(fp.directors_names, '{}'),
+            'actors_names', COALESCE(fp.actors_names, '{}'),
+            'writers_names', COALESCE(fp.writers_names, '{}'),
+            'genres', COALESCE(fg.objects, '[]'),
+            'directors', COALESCE(fp.directors, '[]'),
+            'actors', COALESCE(fp.actors, '[]'),
+            'writers', COALESCE(fp.writers, '[]')
+        ),
+        now()
+    FROM content.film_work fw
+    LEFT JOIN LATERAL (
+        SELECT
+            ARRAY_AGG(DISTINCT g.name) FILTER (WHERE g.name IS NOT NULL) AS names,
+            JSONB_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) FILTER (WHERE g.id IS NOT NULL) AS objects
+        FROM content.genre_film_work gfw
+        JOIN content.genre g ON g.id = gfw.genre_id
+        WHERE gfw.film_work_id = fw.id
+    ) fg ON true
+    LEFT JOIN LATERAL (
+        SELECT
+            ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director') AS directors_names,
+            ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
+            ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names,
+            JSONB_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'director') AS directors,
+            JSONB_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'actor') AS actors,
+            JSONB_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'writer') AS writers
+        FROM content.person_film_work pfw
+        JOIN content.person p ON p.id = pfw.person_id
+        WHERE pfw.film_work_id = fw.id
+    ) fp ON true
+    WHERE fw.id = ANY(ids)
+    ON CONFLICT (id) DO UPDATE
+    SET document = EXCLUDED.document, updated_at = EXCLUDED.updated_at
+    WHERE d.document IS DISTINCT FROM EXCLUDED.document;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер определяет, документы каких фильмов затронуло изменение строки: сам фильм,
+-- фильмы по обе стороны измененной связи или все фильмы переименованного жанра или персоналии.
+
+CREATE OR REPLACE FUNCTION content.refresh_film_work_document() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'film_work' THEN
+        PERFORM content.refresh_film_work_documents(
+            ARRAY[CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END]);
+    ELSIF TG_TABLE_NAME IN ('genre_film_work', 'person_film_work') THEN
+        PERFORM content.refresh_film_work_documents(ARRAY_REMOVE(ARRAY[
+            CASE WHEN TG_OP <> 'INSERT' THEN OLD.film_work_id END,
+            CASE WHEN TG_OP <> 'DELETE' THEN NEW.film_work_id END
+        ], NULL));
+    ELSIF TG_TABLE_NAME = 'genre' THEN
+        PERFORM content.refresh_film_work_documents(ARRAY(
+            SELECT film_work_id FROM content.genre_film_work WHERE genre_id = NEW.id));
+    ELSIF TG_TABLE_NAME = 'person' THEN
+        PERFORM content.refresh_film_work_documents(ARRAY(
+            SELECT film_work_id FROM content.person_film_work WHERE person_id = NEW.id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS film_work_document_refresh ON content.film_work;
+CREATE TRIGGER film_work_document_refresh AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.refresh_film_work_document();
+
+-- Жанр и персоналия без связей ни в один документ не входят, а удалить их, пока связи есть,
+-- не дает внешний ключ, поэтому для них достаточно переименования.
+
+DROP TRIGGER IF EXISTS genre_document_refresh ON content.genre;
+CREATE TRIGGER genre_document_refresh AFTER UPDATE ON content.genre
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION content.refresh_film_work_document();
+
+DROP TRIGGER IF EXISTS person_document_refresh ON content.person;
+CREATE TRIGGER person_document_refresh AFTER UPDATE ON content.person
+    FOR EACH ROW WHEN (OLD.full_name IS DISTINCT FROM NEW.full_name)
+    EXECUTE FUNCTION content.refresh_film_work_document();
+
+DROP TRIGGER IF EXISTS genre_film_work_document_refresh ON content.genre_film_work;
+CREATE TRIGGER genre_film_work_document_refresh AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.refresh_film_work_document();
+
+DROP TRIGGER IF EXISTS person_film_work_document_refresh ON content.person_film_work;
+CREATE TRIGGER person_film_work_document_refresh AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.refresh_film_work_document();
+
+-- Документы фильмов, которые уже есть в БД:
+
+SELECT content.refresh_film_work_documents(ARRAY(SELECT id FROM content.film_work));
@@ -0,0 +1,67 @@
+import statistics
+from time import perf_counter
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.v1.views import MoviesDetailApi
+from movies.models import FilmWork, FilmWorkGenre, FilmWorkPerson, FilmWorkType, Genre, Person
+
+ROLES = ('actor', 'writer', 'director')
+
+
+def get_array_agg_queryset():
+    """Прежний запрос API: жанры и персоналии в одном GROUP BY и ArrayAgg(distinct=True) по ролям."""
+    qs = FilmWork.objects.values('id', 'title', 'description', 'creation_date', 'rating', 'type')
+    qs = qs.annotate(genres=ArrayAgg('genres__name', distinct=True))
+    for role in ROLES:
+        qs = qs.annotate(**{f'{role}s': ArrayAgg('persons__full_name', distinct=True,
+                                                 filter=Q(filmworkperson__role=role))})
+    return qs
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время запроса карточки фильма API прежним способом (ArrayAgg по JOIN жанров "
+        "и персоналий) и подзапросами ARRAY(SELECT ...) в зависимости от размера состава фильма. "
+        "Тестовые фильмы создаются в транзакции, которая откатывается после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cast-sizes', nargs='+', type=int, default=[10, 100, 500, 1000])
+        parser.add_argument('--genres', type=int, default=5, help="жанров у тестового фильма")
+        parser.add_argument('--repeat', type=int, default=20, help="повторов каждого запроса")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'cast':>6} {'array_agg, ms':>14} {'subquery, ms':>13} {'speedup':>8}")
+        with transaction.atomic():
+            genres = Genre.objects.bulk_create([Genre(name=f'bench genre {i}') for i in range(options['genres'])])
+            for cast_size in options['cast_sizes']:
+                film = self.create_film(cast_size, genres)
+                legacy = self.measure(get_array_agg_queryset().filter(id=film.id), options['repeat'])
+                current = self.measure(MoviesDetailApi().get_queryset().filter(id=film.id), options['repeat'])
+                self.stdout.write(f"{cast_size:>6} {legacy:>14.2f} {current:>13.2f} {legacy / current:>7.1f}x")
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def create_film(cast_size: int, genres: list) -> FilmWork:
+        """Функция создает фильм с жанрами genres и составом из cast_size персоналий, роли по кругу."""
+        film = FilmWork.objects.create(title=f'bench film {cast_size}', type=FilmWorkType.MOVIE)
+        persons = Person.objects.bulk_create([Person(full_name=f'bench person {cast_size}-{i}')
+                                              for i in range(cast_size)])
+        FilmWorkGenre.objects.bulk_create([FilmWorkGenre(film_work=film, genre=genre) for genre in genres])
+        FilmWorkPerson.objects.bulk_create([FilmWorkPerson(film_work=film, person=person, role=ROLES[i % len(ROLES)])
+                                            for i, person in enumerate(persons)])
+        return film
+
+    @staticmethod
+    def measure(queryset, repeat: int) -> float:
+        """Функция возвращает медианное время выполнения запроса в миллисекундах."""
+        timings = []
+        for _ in range(repeat):
+            started_at = perf_counter()
+            list(queryset.all())
+            timings.append((perf_counter() - started_at) * 1000)
+        return statistics.median(timings)
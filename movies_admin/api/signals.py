@@ -0,0 +1,43 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.v1.cache import invalidate_movies
+from movies.models import FilmWork, FilmWorkGenre, FilmWorkPerson, Genre, Person
+
+
+@receiver([post_save, post_delete], sender=FilmWork)
+def invalidate_film_work(sender, instance, **kwargs):
+    invalidate_movies([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=FilmWorkGenre)
+@receiver([post_save, post_delete], sender=FilmWorkPerson)
+def invalidate_film_work_link(sender, instance, **kwargs):
+    invalidate_movies([instance.film_work_id])
+
+
+@receiver(m2m_changed, sender=FilmWork.genres.through)
+@receiver(m2m_changed, sender=FilmWork.persons.through)
+def invalidate_film_work_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменение связей через film.genres.add() и т.п. не вызывает post_save у промежуточной модели."""
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_movies([instance.pk])
+    elif action == 'pre_clear':
+        # После очистки связей со стороны жанра или персоналии ее фильмы уже не найти.
+        field = 'genres' if isinstance(instance, Genre) else 'persons'
+        invalidate_movies(FilmWork.objects.filter(**{field: instance}).values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_movies(pk_set)
+
+
+@receiver([post_save, post_delete], sender=Genre)
+def invalidate_genre(sender, instance, **kwargs):
+    """Название жанра входит в карточки всех его фильмов."""
+    invalidate_movies(FilmWorkGenre.objects.filter(genre_id=instance.pk).values_list('film_work_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Person)
+def invalidate_person(sender, instance, **kwargs):
+    """Имя персоналии входит в карточки всех фильмов с ее участием."""
+    invalidate_movies(FilmWorkPerson.objects.filter(person_id=instance.pk).values_list('film_work_id', flat=True))
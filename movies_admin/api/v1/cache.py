@@ -0,0 +1,42 @@
+import hashlib
+import time
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import QueryDict
+
+LIST_GENERATION_KEY = 'api:v1:movies:list:generation'
+
+
+def get_list_generation() -> int:
+    """
+    Поколение кэша списков фильмов. Любое изменение каталога может сдвинуть фильмы между
+    страницами, поэтому списки не удаляются по одному, а устаревают все сразу при смене поколения.
+    Если ключ вытеснен из кэша, новое поколение берется из времени, чтобы не совпасть со старым.
+    """
+    return cache.get_or_set(LIST_GENERATION_KEY, lambda: int(time.time() * 1000), timeout=None)
+
+
+def movies_list_key(query: QueryDict) -> str:
+    """Ключ страницы списка: поколение и все параметры запроса (страница, курсор, фильтры)."""
+    params = '&'.join(f'{name}={value}' for name, values in sorted(query.lists()) for value in values)
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return f'api:v1:movies:list:{get_list_generation()}:{digest}'
+
+
+def movie_detail_key(film_id) -> str:
+    return f'api:v1:movies:detail:{film_id}'
+
+
+def invalidate_movies(film_ids: Iterable) -> None:
+    """Функция удаляет из кэша карточки фильмов film_ids и все страницы списка."""
+    cache.delete_many([movie_detail_key(film_id) for film_id in film_ids])
+    try:
+        cache.incr(LIST_GENERATION_KEY)
+    except ValueError:
+        get_list_generation()
+
+
+def get_cache_timeout() -> int:
+    return getattr(settings, 'API_CACHE_TIMEOUT', 300)
@@ -0,0 +1,53 @@
+from typing import Sequence
+
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import BooleanField, Expression, F, Subquery, Value
+from django.utils.functional import cached_property
+
+
+class ArraySubquery(Subquery):
+    """
+    Коррелированный подзапрос, результат которого собирается в массив: ARRAY(SELECT ...).
+
+    В Django 3.2 такого выражения нет (появилось в 4.0 как django.contrib.postgres.expressions.ArraySubquery).
+    Подзапрос должен возвращать одну колонку; порядок элементов задается order_by подзапроса.
+    """
+    template = 'ARRAY(%(subquery)s)'
+
+    @cached_property
+    def output_field(self):
+        return ArrayField(self.query.output_field)
+
+
+class RowComparison(Expression):
+    """
+    Сравнение кортежей (f1, f2, ...) > (v1, v2, ...) (или <) для фильтра по курсору.
+
+    В отличие от раскрытия через OR (f1 > v1 OR f1 = v1 AND f2 > v2 ...) такое условие Postgres
+    превращает в границу диапазона составного индекса и начинает чтение сразу с нужной позиции.
+    Все поля сравниваются в одном направлении, как в индексе.
+    """
+    output_field = BooleanField()
+
+    def __init__(self, fields: Sequence[str], values: Sequence, operator: str):
+        super().__init__()
+        if operator not in ('>', '<'):
+            raise ValueError(f"Unsupported operator: {operator}")
+        self.fields = [F(field) for field in fields]
+        self.values = [Value(value) for value in values]
+        self.operator = operator
+
+    def get_source_expressions(self):
+        return [*self.fields, *self.values]
+
+    def set_source_expressions(self, exprs):
+        self.fields, self.values = exprs[:len(self.fields)], exprs[len(self.fields):]
+
+    def as_sql(self, compiler, connection):
+        fields_sql, values_sql, params = [], [], []
+        for expressions, sql_parts in ((self.fields, fields_sql), (self.values, values_sql)):
+            for expression in expressions:
+                sql, expression_params = compiler.compile(expression)
+                sql_parts.append(sql)
+                params.extend(expression_params)
+        return f"({', '.join(fields_sql)}) {self.operator} ({', '.join(values_sql)})", params
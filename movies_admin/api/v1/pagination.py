@@ -0,0 +1,111 @@
+import base64
+import json
+from typing import Optional, Sequence, Tuple
+
+from django.core.exceptions import BadRequest
+from django.db import connection
+from django.db.models import QuerySet
+
+from api.v1.expressions import RowComparison
+
+
+def encode_cursor(values: Sequence, reverse: bool, backend: str) -> str:
+    """
+    Функция упаковывает значения ключа сортировки, направление и источник данных (backend),
+    который выдал курсор, в непрозрачный курсор.
+    """
+    payload = json.dumps({'v': list(values), 'r': reverse, 'b': backend}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, backend: str) -> Optional[Tuple[list, bool]]:
+    """
+    Функция распаковывает курсор. Курсор другого источника данных (например, выданный
+    elasticSearch, когда API перешел на чтение из БД) не подходит к его сортировке:
+    возвращается None, и список открывается с первой страницы.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, reverse = payload['v'], bool(payload['r'])
+    except (ValueError, TypeError, KeyError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list):
+        raise BadRequest('Invalid cursor')
+    if payload.get('b') != backend:
+        return None
+    return values, reverse
+
+
+class CursorPaginator:
+    """
+    Постраничный вывод по курсору (keyset pagination) вместо номера страницы.
+
+    Страница выбирается условием (title, id) > (курсор) по индексу, а не через OFFSET,
+    поэтому любая страница стоит столько же, сколько первая. Точный COUNT(*) не выполняется:
+    общее число записей оценивается по статистике Postgres, и только для списка без фильтров.
+
+    Курсор непрозрачен для клиента: это base64 от значений ключа сортировки последней
+    (для next) или первой (для prev) записи страницы, направления и источника данных.
+    """
+    cursor_backend = 'orm'
+
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: Sequence[str] = ('title', 'id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def decode_cursor(self, cursor: str) -> Optional[Tuple[list, bool]]:
+        decoded = decode_cursor(cursor, self.cursor_backend)
+        if decoded is not None and len(decoded[0]) != len(self.ordering):
+            raise BadRequest('Invalid cursor')
+        return decoded
+
+    def get_keyset_filter(self, values: Sequence, reverse: bool) -> RowComparison:
+        """Условие (f1, f2, ...) > (v1, v2, ...) (или < для обратного направления) сравнением кортежей."""
+        return RowComparison(self.ordering, values, '<' if reverse else '>')
+
+    def get_position(self, item: dict) -> list:
+        return [str(item[field]) for field in self.ordering]
+
+    def page(self, cursor: Optional[str]) -> Tuple[list, Optional[str], Optional[str]]:
+        """
+        Функция возвращает записи страницы и курсоры соседних страниц.
+
+        :param cursor: курсор из next/prev предыдущего ответа, пустой или выданный другим
+            источником данных - первая страница
+        :return: записи, курсор следующей страницы, курсор предыдущей страницы
+        """
+        reverse = False
+        queryset = self.queryset
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is not None:
+            values, reverse = decoded
+            queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+        ordering = [f'-{field}' for field in self.ordering] if reverse else list(self.ordering)
+        items = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if reverse:
+            items.reverse()
+        if not items:
+            return items, None, None
+
+        # Страница, открытая по курсору prev, всегда имеет следующую, открытая по next - предыдущую.
+        has_next = reverse or has_more
+        has_prev = (reverse and has_more) or (not reverse and decoded is not None)
+        next_cursor = encode_cursor(self.get_position(items[-1]), False, self.cursor_backend) if has_next else None
+        prev_cursor = encode_cursor(self.get_position(items[0]), True, self.cursor_backend) if has_prev else None
+        return items, next_cursor, prev_cursor
+
+    def estimate_count(self) -> Optional[int]:
+        """
+        Функция возвращает оценку числа записей таблицы модели по статистике Postgres.
+        Для отфильтрованного списка оценка по всей таблице неверна, поэтому возвращается None.
+        """
+        if self.queryset.query.has_filters():
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                           [self.queryset.model._meta.db_table.replace('"."', '.')])
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else 0
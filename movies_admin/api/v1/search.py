@@ -0,0 +1,108 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from elasticsearch import Elasticsearch, NotFoundError
+
+from api.v1.pagination import decode_cursor, encode_cursor
+
+FILM_INDEX = 'film'
+PERSON_ROLES = ('directors', 'actors', 'writers')
+SEARCH_FIELDS = ['title^3', 'description', 'genres_names', 'actors_names', 'directors_names', 'writers_names']
+
+
+@lru_cache(maxsize=None)
+def get_client() -> Elasticsearch:
+    """Клиент elasticSearch, общий для процесса. Таймаут короткий, чтобы быстро перейти на ORM."""
+    return Elasticsearch(hosts=[settings.ELASTICSEARCH_URL], timeout=settings.ELASTICSEARCH_TIMEOUT, max_retries=0)
+
+
+class FilmSearch:
+    """
+    Чтение фильмов из индекса film, который поддерживает ETL, вместо запросов к Postgres.
+
+    Список листается через search_after по сортировке (title.raw, id), а при полнотекстовом
+    запросе - по (_score, title.raw, id). Курсор имеет тот же формат, что и у CursorPaginator,
+    но помечен источником 'es': порядок keyword в индексе не совпадает с сортировкой Postgres,
+    поэтому при переходе API на чтение из БД такой курсор открывает первую страницу.
+    """
+    cursor_backend = 'es'
+
+    def __init__(self, client: Optional[Elasticsearch] = None, index: str = FILM_INDEX):
+        self.client = client or get_client()
+        self.index = index
+
+    @staticmethod
+    def build_query(query: Optional[str], genres: List[str], persons: List[str]) -> dict:
+        must = [{'multi_match': {'query': query, 'fields': SEARCH_FIELDS, 'fuzziness': 'AUTO'}}] if query else []
+        filters = []
+        if genres:
+            filters.append({'nested': {'path': 'genres', 'query': {'terms': {'genres.id': genres}}}})
+        for person in persons:
+            filters.append({'bool': {'should': [
+                {'nested': {'path': role, 'query': {'term': {f'{role}.id': person}}}} for role in PERSON_ROLES
+            ]}})
+        if not must and not filters:
+            return {'match_all': {}}
+        return {'bool': {'must': must, 'filter': filters}}
+
+    @staticmethod
+    def get_sort(query: Optional[str], reverse: bool) -> list:
+        fields = ([('_score', 'desc')] if query else []) + [('title.raw', 'asc'), ('id', 'asc')]
+        opposite = {'asc': 'desc', 'desc': 'asc'}
+        return [{field: opposite[order] if reverse else order} for field, order in fields]
+
+    @staticmethod
+    def to_movie(source: dict) -> dict:
+        """Функция приводит документ индекса к формату ответа API, который отдает и ORM."""
+        return {
+            'id': source['id'],
+            'title': source['title'],
+            'description': source.get('description'),
+            'creation_date': source.get('creation_date'),
+            'rating': source.get('rating'),
+            'type': source.get('type'),
+            'genres': source.get('genres_names') or [],
+            'actors': source.get('actors_names') or [],
+            'writers': source.get('writers_names') or [],
+            'directors': source.get('directors_names') or [],
+        }
+
+    def search(self, query: Optional[str], genres: List[str], persons: List[str], cursor: Optional[str],
+               size: int) -> Tuple[list, Optional[str], Optional[str], int]:
+        """
+        Функция возвращает страницу фильмов, курсоры соседних страниц и число найденных фильмов.
+        Логика курсоров та же, что в CursorPaginator.page.
+        """
+        body = {'query': self.build_query(query, genres, persons), 'size': size + 1}
+        reverse = False
+        decoded = decode_cursor(cursor, self.cursor_backend) if cursor else None
+        if decoded is not None:
+            values, reverse = decoded
+            body['search_after'] = values
+        body['sort'] = self.get_sort(query, reverse)
+        if decoded is not None and len(decoded[0]) != len(body['sort']):
+            raise BadRequest('Invalid cursor')
+        response = self.client.search(index=self.index, body=body)
+        hits = response['hits']['hits']
+        has_more = len(hits) > size
+        hits = hits[:size]
+        if reverse:
+            hits.reverse()
+        count = response['hits']['total']['value']
+        if not hits:
+            return [], None, None, count
+
+        has_next = reverse or has_more
+        has_prev = (reverse and has_more) or (not reverse and decoded is not None)
+        next_cursor = encode_cursor(hits[-1]['sort'], False, self.cursor_backend) if has_next else None
+        prev_cursor = encode_cursor(hits[0]['sort'], True, self.cursor_backend) if has_prev else None
+        return [self.to_movie(hit['_source']) for hit in hits], next_cursor, prev_cursor, count
+
+    def get(self, film_id) -> Optional[dict]:
+        """Функция возвращает фильм по id или None, если документа еще нет в индексе."""
+        try:
+            return self.to_movie(self.client.get(index=self.index, id=str(film_id))['_source'])
+        except NotFoundError:
+            return None
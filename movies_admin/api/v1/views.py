@@ -1,24 +1,58 @@
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Q
+import abc
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Q
+from django.db.models.fields.json import KeyTransform
 from django.http import JsonResponse
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.list import BaseListView
 
-from movies.models import FilmWork
+from api.v1.cache import get_cache_timeout, movie_detail_key, movies_list_key
+from api.v1.expressions import ArraySubquery
+from api.v1.pagination import CursorPaginator
+from api.v1.search import FilmSearch
+from elasticsearch import ElasticsearchException
+from movies.models import FilmWork, FilmWorkGenre, FilmWorkPerson, Genre, Person
+
+logger = logging.getLogger(__name__)
 
 
-class MoviesApiMixin:
+class MoviesApiMixin(abc.ABC):
     model = FilmWork
     http_method_names = ['get']
 
     @staticmethod
-    def get_role_aggregation(role):
-        return ArrayAgg('persons__full_name',
-                        distinct=True,
-                        filter=Q(filmworkperson__role=role))
+    def get_genres_subquery():
+        return ArraySubquery(
+            Genre.objects.filter(filmworkgenre__film_work=OuterRef('pk')).order_by('name').distinct().values('name')
+        )
+
+    @staticmethod
+    def get_role_subquery(role):
+        return ArraySubquery(
+            Person.objects.filter(
+                filmworkperson__film_work=OuterRef('pk'),
+                filmworkperson__role=role,
+            ).order_by('full_name').distinct().values('full_name')
+        )
+
+    @staticmethod
+    def get_document_field(key):
+        return KeyTransform(key, 'document__document')
 
     def get_queryset(self):
-        qs = self.model.objects.prefetch_related('genres', 'persons').all().values(
+        """
+        При MOVIES_API_FILM_DOCUMENTS жанры и персоналии берутся из готового документа фильма
+        (content.film_work_document), который присоединяется по первичному ключу.
+
+        Иначе жанры и персоналии каждой роли собираются отдельными коррелированными подзапросами
+        ARRAY(SELECT ...) по индексам связующих таблиц. Раньше жанры и персоналии соединялись
+        в одном GROUP BY и ArrayAgg(distinct=True) перебирал произведение жанров на весь состав
+        фильма - для фильмов с большим составом это росло квадратично.
+        """
+        qs = self.model.objects.values(
             'id',
             'title',
             'description',
@@ -26,23 +60,121 @@ class MoviesApiMixin:
             'rating',
             'type',
         )
-        qs = qs.annotate(genres=ArrayAgg('genres__name', distinct=True))
-        qs = qs.annotate(actors=self.get_role_aggregation('actor'))
-        qs = qs.annotate(writers=self.get_role_aggregation('writer'))
-        qs = qs.annotate(directors=self.get_role_aggregation('director'))
-        return qs
+        if settings.MOVIES_API_FILM_DOCUMENTS:
+            return qs.annotate(
+                genres=self.get_document_field('genres_names'),
+                actors=self.get_document_field('actors_names'),
+                writers=self.get_document_field('writers_names'),
+                directors=self.get_document_field('directors_names'),
+            )
+        return qs.annotate(
+            genres=self.get_genres_subquery(),
+            actors=self.get_role_subquery('actor'),
+            writers=self.get_role_subquery('writer'),
+            directors=self.get_role_subquery('director'),
+        )
+
+    @abc.abstractmethod
+    def get_cache_key(self) -> str:
+        """Ключ ответа в кэше."""
+
+    @abc.abstractmethod
+    def get_response_data(self):
+        """Данные ответа, которые кэшируются и отдаются в JSON."""
+
+    def get(self, request, *args, **kwargs):
+        """
+        Ответ берется из кэша, пока фильмы не изменились (кэш сбрасывают api/signals.py
+        и ETL после загрузки в elasticSearch), иначе
+        собирается запросом к БД и кэшируется на API_CACHE_TIMEOUT секунд.
+
+        Ответы из elasticSearch кэшируются, только если кэш сбрасывает ETL
+        (API_CACHE_ETL_INVALIDATION): сигнал сбрасывает кэш до того, как ETL загрузит изменение
+        в индекс, и следующий запрос закэшировал бы старый документ.
+        """
+        if self.use_search() and not settings.API_CACHE_ETL_INVALIDATION:
+            return self.render_to_response(self.get_response_data())
+        key = self.get_cache_key()
+        context = cache.get(key)
+        if context is None:
+            context = self.get_response_data()
+            cache.set(key, context, get_cache_timeout())
+        return self.render_to_response(context)
 
     def render_to_response(self, context, **response_kwargs):
         return JsonResponse(context)
 
+    @staticmethod
+    def use_search() -> bool:
+        return settings.MOVIES_API_BACKEND == 'elasticsearch'
+
 
 class MoviesListApi(MoviesApiMixin, BaseListView):
     model = FilmWork
     http_method_names = ['get']
     paginate_by = 50
 
+    def get_cache_key(self) -> str:
+        return movies_list_key(self.request.GET)
+
+    def get_response_data(self):
+        if self.use_search():
+            try:
+                return self.get_search_context_data()
+            except ElasticsearchException as e:
+                logger.warning(f"elasticSearch is unavailable, read movies from the database: {e}")
+        self.object_list = self.get_queryset()
+        return self.get_context_data()
+
+    def get_filters(self):
+        """
+        Параметры поиска: ?query= - полнотекстовый запрос, ?genre= и ?person= - id, можно несколько.
+
+        ?query= ищется в названии, описании, названиях жанров и именах персоналий при чтении
+        и из elasticSearch, и из БД. Различия остаются: elasticSearch допускает опечатки
+        (fuzziness AUTO) и сортирует по релевантности, а БД ищет подстроку без учета регистра
+        и сортирует как список без запроса.
+        """
+        return (self.request.GET.get('query') or None,
+                self.request.GET.getlist('genre'),
+                self.request.GET.getlist('person'))
+
+    def get_queryset(self):
+        """
+        Фильтры по жанру и персоналии задаются подзапросами, а не через genres/persons: JOIN
+        со связующими таблицами повторил бы фильм столько раз, сколько у него подходящих связей.
+        """
+        qs = super().get_queryset()
+        query, genres, persons = self.get_filters()
+        if query:
+            qs = qs.filter(
+                Q(title__icontains=query)
+                | Q(description__icontains=query)
+                | Q(id__in=FilmWorkGenre.objects.filter(genre__name__icontains=query).values('film_work_id'))
+                | Q(id__in=FilmWorkPerson.objects.filter(person__full_name__icontains=query).values('film_work_id'))
+            )
+        if genres:
+            qs = qs.filter(id__in=FilmWorkGenre.objects.filter(genre_id__in=genres).values('film_work_id'))
+        for person in persons:
+            qs = qs.filter(id__in=FilmWorkPerson.objects.filter(person_id=person).values('film_work_id'))
+        return qs
+
+    def get_search_context_data(self):
+        """Список из индекса film: всегда постранично по курсору (search_after)."""
+        query, genres, persons = self.get_filters()
+        results, next_cursor, prev_cursor, count = FilmSearch().search(
+            query, genres, persons, self.request.GET.get('cursor'), self.paginate_by)
+        return {
+            "count": count,
+            "prev": prev_cursor,
+            "next": next_cursor,
+            "results": results
+        }
+
     def get_context_data(self, *, object_list=None, **kwargs):
         queryset = self.get_queryset()
+        if 'cursor' in self.request.GET:
+            return self.get_cursor_context_data(queryset)
         paginator, page, queryset, is_paginated = self.paginate_queryset(
             queryset,
             self.paginate_by
@@ -55,10 +187,39 @@ class MoviesListApi(MoviesApiMixin, BaseListView):
             "results": list(queryset)
         }
 
+    def get_cursor_context_data(self, queryset):
+        """
+        Постраничный вывод по курсору: включается параметром ?cursor= (пустым для первой страницы),
+        next и prev содержат курсоры соседних страниц, count - оценка без COUNT(*), для списка
+        с фильтрами - null.
+        """
+        paginator = CursorPaginator(queryset, self.paginate_by)
+        results, next_cursor, prev_cursor = paginator.page(self.request.GET['cursor'])
+        return {
+            "count": paginator.estimate_count(),
+            "prev": prev_cursor,
+            "next": next_cursor,
+            "results": results
+        }
+
 
 class MoviesDetailApi(MoviesApiMixin, BaseDetailView):
     model = FilmWork
     http_method_names = ['get']
 
+    def get_cache_key(self) -> str:
+        return movie_detail_key(self.kwargs['pk'])
+
+    def get_response_data(self):
+        if self.use_search():
+            try:
+                movie = FilmSearch().get(self.kwargs['pk'])
+                if movie is not None:
+                    return movie
+            except ElasticsearchException as e:
+                logger.warning(f"elasticSearch is unavailable, read movie from the database: {e}")
+        self.object = self.get_object()
+        return self.get_context_data(object=self.object)
+
     def get_context_data(self, **kwargs):
         return kwargs['object']
@@ -73,6 +73,33 @@ DATABASES = {
         }
 }
 
+# Кэш ответов API. По умолчанию кэш в памяти процесса с вытеснением давно не использованных
+# записей (LRU); для нескольких процессов gunicorn нужен общий кэш, например
+# CACHE_URL=memcache://movies-cache:11211 (с клиентом python-memcached) или rediscache://
+# (с django-redis), иначе сброс по изменению фильма виден только в процессе, где фильм был
+# изменен, а остальные отдают старый ответ до истечения TTL. С общим кэшем в Redis его может
+# сбрасывать и ETL после загрузки в elasticSearch (api_cache в postgres_to_es/config.json).
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://movies-api'),
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', default=1000)}
+
+API_CACHE_TIMEOUT = env.int('API_CACHE_TIMEOUT', default=300)
+# Ответы из elasticSearch кэшируются, только если кэш сбрасывает ETL после загрузки в индекс.
+API_CACHE_ETL_INVALIDATION = env.bool('API_CACHE_ETL_INVALIDATION', default=False)
+
+# Источник данных API фильмов: 'orm' - запросы к Postgres, 'elasticsearch' - индекс film,
+# который заполняет ETL. При недоступности elasticSearch API читает данные из Postgres.
+# ?query= в Postgres ищет подстроку в тех же полях, но без опечаток и ранжирования по релевантности.
+MOVIES_API_BACKEND = env.str('MOVIES_API_BACKEND', default='orm')
+ELASTICSEARCH_URL = env.str('ELASTICSEARCH_URL', default='http://elasticsearch:9200')
+ELASTICSEARCH_TIMEOUT = env.float('ELASTICSEARCH_TIMEOUT', default=2.0)
+
+# Жанры и персоналии фильмов читаются из готовых документов content.film_work_document
+# (etc/db/db_schema_film_document.sql) вместо подзапросов к связующим таблицам.
+MOVIES_API_FILM_DOCUMENTS = env.bool('MOVIES_API_FILM_DOCUMENTS', default=False)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -12,6 +12,7 @@ env = environ.Env()
 env.read_env()
 
 all_tables = ['film_work', 'genre', 'person', 'genre_film_work', 'person_film_work']
+FETCH_SIZE = 1000
 
 
 class SQLiteLoader:
@@ -19,18 +20,18 @@ class SQLiteLoader:
         self.connection = connection
         self.cursor = self.connection.cursor()
 
-    def get_data_from_table(self, table: str):
+    def get_data_from_table(self, table: str, size: int = FETCH_SIZE):
+        """ Генератор лениво читает таблицу порциями по size строк, не загружая ее в память целиком. """
         self.cursor.execute(f"SELECT * FROM {table}")
-        for _ in self.cursor.fetchall():
-            yield _
+        while rows := self.cursor.fetchmany(size):
+            yield from rows
 
     def write_table_to_csv_file(self, table: str):
         if not os.path.isdir("tables"):
             os.mkdir("tables")
         with open(os.path.join("tables", f"{table}.csv"), 'w') as f:
-            for entry in self.get_data_from_table(table):
-                writer = csv.writer(f, delimiter=",", lineterminator="\r")
-                writer.writerow(entry)
+            writer = csv.writer(f, delimiter=",", lineterminator="\r")
+            writer.writerows(self.get_data_from_table(table))
 
     def load_movies(self):
         for table in all_tables:
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        # Индекс для постраничного вывода по курсору (title, id). Схема БД создается также
+        # из etc/db/db_schema.sql, поэтому индекс создается только если его еще нет.
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS film_work_title_id_idx ON content.film_work (title, id);',
+            reverse_sql='DROP INDEX IF EXISTS content.film_work_title_id_idx;',
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='filmwork',
+                    index=models.Index(fields=['title', 'id'], name='film_work_title_id_idx'),
+                ),
+            ],
+        ),
+    ]
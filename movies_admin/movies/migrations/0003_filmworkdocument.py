@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_film_work_title_id_idx'),
+    ]
+
+    operations = [
+        # Таблица и триггеры создаются скриптом etc/db/db_schema_film_document.sql,
+        # Django таблицей не управляет.
+        migrations.CreateModel(
+            name='FilmWorkDocument',
+            fields=[
+                ('film_work', models.OneToOneField(db_column='id', on_delete=django.db.models.deletion.DO_NOTHING,
+                                                   primary_key=True, related_name='document', serialize=False,
+                                                   to='movies.filmwork')),
+                ('document', models.JSONField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'content"."film_work_document',
+                'managed': False,
+            },
+        ),
+    ]
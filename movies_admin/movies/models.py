@@ -97,6 +97,9 @@ class FilmWork(TimeStampedMixin):
         verbose_name = _("film work")
         verbose_name_plural = _("film works")
         db_table = 'content"."film_work'
+        indexes = [
+            models.Index(fields=("title", "id"), name="film_work_title_id_idx"),
+        ]
 
     def __str__(self):
         return self.title
@@ -104,3 +107,19 @@ class FilmWork(TimeStampedMixin):
     @property
     def get_genres(self) -> list:
         return list(self.genres.all().values_list('name', flat=True))
+
+
+class FilmWorkDocument(models.Model):
+    """
+    Готовый документ кинопроизведения с жанрами и персоналиями по ролям в формате индекса film.
+    Таблицу создает и поддерживает Postgres (etc/db/db_schema_film_document.sql): триггеры
+    пересобирают документ при любом изменении фильма, его связей, жанров и персоналий.
+    """
+    film_work = models.OneToOneField(FilmWork, primary_key=True, db_column='id', on_delete=models.DO_NOTHING,
+                                     related_name='document')
+    document = models.JSONField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'content"."film_work_document'
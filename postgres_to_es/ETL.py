@@ -1,231 +1,440 @@
+import asyncio
 import logging
-from datetime import datetime
-from time import sleep
+from time import sleep, monotonic
+from typing import Optional
 
-from config import STORAGE, LIMIT, FETCH_DELAY
-from utils.dataclasses_etl import FilmWork, FilmWorkPerson, FilmWorkGenre, Genre, Person
-from utils.decorators import coroutine
+from config import (LIMIT, FETCH_DELAY, ACCUMULATOR_BATCH_SIZE, ACCUMULATOR_FLUSH_INTERVAL, ETL_RUNNER,
+                    CHECKPOINT_PAGES, CHANGE_FEED_ENABLED, CHANGE_FEED_CHANNEL, CHANGE_FEED_FALLBACK_INTERVAL,
+                    EXTRACT_MODE,
+                    DOCUMENT_HASHES_PATH, METRICS_ENABLED, METRICS_PORT, API_CACHE_URL, API_CACHE_KEY_PREFIX,
+                    API_CACHE_VERSION)
+from utils.api_cache import ApiCache
+from utils.cursors import START_CRAWL_ID, checkpoint, get_cursor, is_backfill
+from utils.change_feed import ChangeFeed
+from utils.decorators import backoff, coroutine
 from utils.es_utils import ElasticSearchConnector
-from utils.pg_utils import PostgresConnector
-from state import State
+from utils.hashes import DocumentHashes
+from utils.metrics import BULK_DOCUMENTS, STAGE_SECONDS, ROWS, observe_batches, start_metrics_server, watch_crawl_lag
+from utils.pg_utils import CONNECTION_ERRORS, PostgresConnector
+from utils.queries import (CHANGED_ROWS_QUERY, PENDING_ROWS_QUERY, FILMS_QUERY, GENRES_QUERY, PERSONS_QUERY,
+                           DENORMALIZE_QUERIES, RAW_DENORMALIZE_QUERIES, RAW_DOCUMENT_QUERIES,
+                           STORED_DOCUMENT_QUERIES, STORED_POLL_TABLES, CHANGE_FEED_EXISTS_QUERY, NOW_QUERY,
+                           CHANGES_QUERY, PURGE_CHANGES_QUERY, CHANGE_FEED_SETTINGS_QUERY, CLEAR_CHANGES_QUERY)
+from utils.transform import chunked, to_film_work, to_genre, to_person, to_raw_document, DOCUMENT_TRANSFORMS
 
-state = State(STORAGE)
+TABLES = ['film_work', 'genre', 'person']
+# Таблица, изменения которой опрашиваются по updated_at вместо самой таблицы.
+POLL_TABLES = STORED_POLL_TABLES if EXTRACT_MODE == 'stored' else {}
 
+# В режиме raw документы собираются в БД, в режиме stored документы кинопроизведений читаются
+# готовыми из content.film_work_document; в обоих случаях они загружаются в elasticSearch без разбора в Python.
+if EXTRACT_MODE == 'raw':
+    MERGE_QUERIES = {table: (RAW_DOCUMENT_QUERIES[table], to_raw_document) for table in TABLES}
+elif EXTRACT_MODE == 'stored':
+    MERGE_QUERIES = {table: (STORED_DOCUMENT_QUERIES[table], to_raw_document) for table in TABLES}
+else:
+    MERGE_QUERIES = {
+        'film_work': (FILMS_QUERY, to_film_work),
+        'genre': (GENRES_QUERY, to_genre),
+        'person': (PERSONS_QUERY, to_person),
+    }
 
-def produce(table: str):
-    """
-    Функция собирает id измененных сущностей в таблице БД, затем передает в enricher
-    для дальнейшего поиска id связанных кинопроизведений, либо ищет id изменившихся
-    кинопроизведений и передает в merger для сбора дополнительной информации по ним.
+pg = PostgresConnector()
+hashes = DocumentHashes(DOCUMENT_HASHES_PATH)
+es = ElasticSearchConnector(hashes)
+api_cache = ApiCache(API_CACHE_URL, API_CACHE_KEY_PREFIX, API_CACHE_VERSION)
 
-    :param consumer: enricher или loader
-    :param table: таблица в БД в которой ведется поиск
+
+def produce(table: str, pipeline: 'Pipeline'):
     """
-    last_crawl_time = state.get_state(f"last_{table}_crawl_time")
-    if not last_crawl_time:
-        last_crawl_time = datetime(1900, 1, 1, 0, 0, 0, 0)
-        state.set_state(f"last_{table}_crawl_time",
-                        datetime.strftime(last_crawl_time, '%Y-%m-%dT%H:%M:%S.%f'))
-    else:
-        last_crawl_time = datetime.strptime(last_crawl_time, '%Y-%m-%dT%H:%M:%S.%f')
-    pg = PostgresConnector()
-    offset = 0
-    while True:
-        data_chunk = pg.query(f"SELECT id, updated_at "
-                              f"FROM content.{table} "
-                              f"WHERE updated_at > %s "
-                              f"ORDER BY updated_at OFFSET %s LIMIT %s; ", (last_crawl_time, offset, LIMIT))
-        if not data_chunk:
-            break
-        logging.info(f"got changed data in '{table}' table")
-        new_last_crawl_time = data_chunk[-1][-1]
-        state.set_state(f"last_{table}_crawl_time",
-                        datetime.strftime(new_last_crawl_time, '%Y-%m-%dT%H:%M:%S.%f'))
+    Функция собирает id измененных сущностей в таблице БД и передает их в pipeline:
+    id кинопроизведений уходят в merger, id жанров и персоналий - в denormalizer,
+    который собирает и их документы, и документы связанных кинопроизведений.
 
-        film_loader = load('film_work')
-        film_merger = merge_film(film_loader)
+    Таблица читается постранично по курсору (updated_at, id), а не через OFFSET,
+    поэтому стоимость каждой страницы не зависит от ее номера, а строки с одинаковым
+    updated_at не теряются и не дублируются на границе страниц. В режиме stored кинопроизведения
+    опрашиваются по таблице готовых документов (POLL_TABLES).
 
-        if table == 'film_work':
-            film_merger.send([item[0] for item in data_chunk])
-        else:
+    Курсор сохраняется в состоянии не сразу, а раз в CHECKPOINT_PAGES страниц и только после
+    сброса буферов pipeline, то есть когда elasticSearch подтвердил загрузку всех данных до него.
 
-            enricher = enrich(film_merger, table)
-            enricher.send([item[0] for item in data_chunk])
+    Если ETL только начинает работу или после курсора накопилось много изменений (BACKFILL_ROWS),
+    затронутые индексы на время догрузки переводятся в режим массовой записи и возвращаются
+    к прежним настройкам, когда таблица прочитана до конца.
 
-            loader = load(table)
-            if table == 'genre':
-                merger = merge_genre(loader)
-            elif table == 'person':
-                merger = merge_person(loader)
-            else:
-                logging.error(f"No '{table}' table")
-                return
-            merger.send([item[0] for item in data_chunk])
-        offset += len(data_chunk)
+    :param table: таблица в БД в которой ведется поиск
+    :param pipeline: собранная один раз на запуск цепочка корутин
+    """
+    last_crawl_time, last_crawl_id = get_cursor(table)
+    source = POLL_TABLES.get(table, table)
+    backfill = is_backfill(last_crawl_time, lambda limit: pg.query(PENDING_ROWS_QUERY.format(table=source),
+                                                                   (last_crawl_time, last_crawl_id, limit))[0][0])
+    backfill_tables = []
+    pages = 0
+    try:
+        while True:
+            with STAGE_SECONDS.labels('extract', table).time():
+                data_chunk = pg.query(CHANGED_ROWS_QUERY.format(table=source), (last_crawl_time, last_crawl_id, LIMIT))
+            ROWS.labels('extract', table).inc(len(data_chunk))
+            if not data_chunk:
+                break
+            if backfill and not backfill_tables:
+                backfill_tables = list(dict.fromkeys(['film_work', table]))
+                for backfill_table in backfill_tables:
+                    es.start_backfill(backfill_table)
+            logging.info(f"got changed data in '{table}' table")
+            last_crawl_id, last_crawl_time = data_chunk[-1]
+
+            pipeline.send(table, [item[0] for item in data_chunk])
+            checkpoint.stage(table, last_crawl_time, last_crawl_id)
+            pages += 1
+            if pages % CHECKPOINT_PAGES == 0:
+                pipeline.checkpoint()
+        if backfill_tables:
+            pipeline.checkpoint()
+    finally:
+        for backfill_table in backfill_tables:
+            es.finish_backfill(backfill_table)
 
 
 @coroutine
-def enrich(merger, table: str):
+def denormalize(film_accumulator, loader, table: str):
     """
-    Корутина принимает список id измененных объектов и собирает id кинопроизведений,
-    которых коснулись эти изменения. Id Кинопроизведений пачками передаются в merger
-    для сбора всей информации по кинопроизведениям.
+    Корутина принимает список id измененных жанров или персоналий и одним запросом к БД
+    находит все кинопроизведения, которых коснулись изменения, и собирает документы
+    самих жанров или персоналий. Результат читается серверным курсором: id кинопроизведений
+    пачками по LIMIT уходят в накопитель, поэтому фильм, связанный с несколькими измененными
+    жанрами или персоналиями, собирается и загружается один раз, а документы жанров
+    или персоналий - в loader их индекса.
 
-    :param merger: Корутина для сбора всех данных о кинопроизведении по id
+    При потере соединения с БД пачка собирается заново целиком: повторно отправленные id
+    накопитель не дублирует, а повторная загрузка документов ничего не меняет.
+
+    :param film_accumulator: Корутина-накопитель id кинопроизведений
+    :param loader: Корутина для загрузки жанров или персоналий в elasticSearch
     :param table: таблица в БД из которой взяты измененные id
     """
+    raw = EXTRACT_MODE != 'objects'
+    sql = (RAW_DENORMALIZE_QUERIES if raw else DENORMALIZE_QUERIES)[table]
+
+    @backoff(exceptions=CONNECTION_ERRORS)
+    def denormalize_batch(ids: list):
+        film_ids, docs = [], []
+        for rows in observe_batches(chunked(pg.stream(sql, (ids, ids)), LIMIT), 'denormalize', table):
+            for kind, doc_id, doc in rows:
+                if kind == 'film_work':
+                    film_ids.append(doc_id)
+                else:
+                    docs.append(to_raw_document((doc_id, doc)) if raw else DOCUMENT_TRANSFORMS[kind](doc))
+            if len(film_ids) >= LIMIT:
+                film_accumulator.send(film_ids)
+                film_ids = []
+            if len(docs) >= LIMIT:
+                loader.send(docs)
+                docs = []
+        if film_ids:
+            film_accumulator.send(film_ids)
+        if docs:
+            loader.send(docs)
+
     while True:
         ids: list = (yield)
-        pg = PostgresConnector()
-        offset = 0
-        while True:
-            data_chunk = pg.query(f"SELECT DISTINCT fw.id, updated_at "
-                                  f"FROM content.film_work fw "
-                                  f"LEFT JOIN content.{table}_film_work rel "
-                                  f"ON rel.film_work_id = fw.id "
-                                  f"WHERE rel.{table}_id IN %s "
-                                  f"ORDER BY updated_at OFFSET %s LIMIT %s; ", (tuple(ids), offset, LIMIT))
-            if not data_chunk:
-                break
-            logging.info(f"enrich data from producer")
-            merger.send([item[0] for item in data_chunk])
-            offset += len(data_chunk)
+        denormalize_batch(ids)
+        logging.info(f"denormalize data from producer")
 
 
 @coroutine
-def merge_film(loader):
+def accumulate(merger, batch_size: int = ACCUMULATOR_BATCH_SIZE, flush_interval: float = ACCUMULATOR_FLUSH_INTERVAL):
     """
-    Корутина принимает список id кинопроизведений и собирает данные по каждому произведению из БД
-    Трансформирует их в удобный формат и передает в loader для загрузки в elasticSearch.
+    Корутина копит id кинопроизведений от producer, denormalize и журнала изменений и передает их
+    в merger одной пачкой без повторов, когда набралось batch_size id или с первого id прошло
+    flush_interval секунд. Так один и тот же фильм, задетый несколькими изменениями, собирается
+    и загружается один раз.
 
-    :param loader: Корутина для загрузки данных в elasticSearch
+    Пустое значение (None) принудительно отправляет накопленное, закрытие корутины тоже
+    досылает остаток, чтобы неполная пачка не потерялась.
+
+    :param merger: Корутина для сбора всех данных о кинопроизведении по id
+    :param batch_size: размер пачки id, при котором она отправляется в merger
+    :param flush_interval: максимальное время ожидания id в буфере в секундах
     """
-    while True:
-        pg = PostgresConnector()
-        film_ids: list = (yield)
-        films_from_pg = pg.query(f'''
-            SELECT
-                fw.id, 
-                fw.rating, 
-                fw.type, 
-                fw.title, 
-                fw.description, 
-                ARRAY_AGG(DISTINCT g.name) AS genres_names,
-                ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director') AS directors_names,
-                ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
-                ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names, 
-                JSON_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genres,
-                JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
-                FILTER (WHERE pfw.role = 'director') AS directors,
-                JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
-                FILTER (WHERE pfw.role = 'actor') AS actors,
-                JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) 
-                FILTER (WHERE pfw.role = 'writer') AS writers
-            FROM content.film_work fw
-            LEFT OUTER JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-            LEFT OUTER JOIN content.person p ON p.id = pfw.person_id
-            LEFT OUTER JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-            LEFT OUTER JOIN content.genre g ON g.id = gfw.genre_id
-            WHERE fw.id IN %s
-            GROUP BY fw.id, fw.title, fw.description, fw.rating;
-            ''', (tuple(film_ids),))
-        films_to_update_in_es = [FilmWork(
-            id=film[0],
-            rating=film[1],
-            type=film[2],
-            title=film[3],
-            description=film[4],
-            genres_names=film[5],
-            directors_names=film[6],
-            actors_names=film[7],
-            writers_names=film[8],
-            genres=[FilmWorkGenre(**person) for person in film[9]] if film[9] else [],
-            directors=[FilmWorkPerson(**person) for person in film[10]] if film[10] else [],
-            actors=[FilmWorkPerson(**person) for person in film[11]] if film[11] else [],
-            writers=[FilmWorkPerson(**person) for person in film[12]] if film[12] else [])
-            for film in films_from_pg]
-
-        loader.send(films_to_update_in_es)
-        logging.info(f"merge data")
+    buffer = {}
+    first_added_at = 0.0
+
+    def flush():
+        ids = list(buffer)
+        buffer.clear()
+        for i in range(0, len(ids), batch_size):
+            merger.send(ids[i:i + batch_size])
+
+    try:
+        while True:
+            ids: Optional[list] = (yield)
+            if ids is None:
+                flush()
+                continue
+            if not buffer:
+                first_added_at = monotonic()
+            buffer.update(dict.fromkeys(ids))
+            if len(buffer) >= batch_size or monotonic() - first_added_at >= flush_interval:
+                flush()
+    except GeneratorExit:
+        flush()
 
 
 @coroutine
-def merge_genre(loader):
+def merge(loader, table: str):
     """
-    Корутина принимает список id жанров, собирает данные по каждому жанру из БД
-    Трансформирует их в удобный формат и передает в loader для загрузки в elasticSearch.
+    Корутина принимает список id объектов таблицы table и собирает их документы из БД
+    запросом из MERGE_QUERIES, трансформирует их и передает в loader для загрузки в elasticSearch.
+    Результат читается серверным курсором и передается пачками по LIMIT. При потере
+    соединения с БД пачка собирается заново целиком.
 
     :param loader: Корутина для загрузки данных в elasticSearch
+    :param table: таблица в БД, документы которой собираются
     """
+    sql, transform = MERGE_QUERIES[table]
+
+    @backoff(exceptions=CONNECTION_ERRORS)
+    def merge_batch(ids: list):
+        rows = pg.stream(sql, (ids,))
+        for docs in observe_batches(chunked((transform(row) for row in rows), LIMIT), 'merge', table):
+            loader.send(docs)
+
     while True:
-        pg = PostgresConnector()
-        genres_ids: list = (yield)
-        genres_from_pg = pg.query(f'''
-            SELECT DISTINCT id, name, description
-            FROM content.genre g
-            WHERE g.id IN %s
-            ''', (tuple(genres_ids),))
-        genres_to_update_in_es = [Genre(
-            id=genre[0],
-            name=genre[1],
-            description=genre[2])
-            for genre in genres_from_pg]
-
-        loader.send(genres_to_update_in_es)
+        ids: list = (yield)
+        merge_batch(ids)
         logging.info(f"merge data")
 
 
 @coroutine
-def merge_person(loader):
+def load(table: str):
     """
-    Корутина принимает список id персоналий, собирает данные по каждой персоналии из БД
-    Трансформирует их в удобный формат и передает в loader для загрузки в elasticSearch.
-
-    :param loader: Корутина для загрузки данных в elasticSearch
+    Корутина принимает порции документов и сохраняет в elasticSearch те из них,
+    содержимое которых изменилось с последней загрузки. После загрузки кинопроизведений
+    их ответы сбрасываются в кэше API.
     """
     while True:
-        pg = PostgresConnector()
-        person_ids: list = (yield)
-        person_from_pg = pg.query(f'''
-            SELECT DISTINCT
-            p.id, 
-            p.full_name, 
-            ARRAY_AGG(DISTINCT pfw.role) AS roles,
-            p.birth_date, 
-            ARRAY_AGG(DISTINCT pfw.film_work_id::text) AS film_ids
-            FROM content.person p
-            LEFT OUTER JOIN content.person_film_work pfw ON p.id = pfw.person_id
-            WHERE p.id IN %s
-            GROUP BY p.id;
-            ''', (tuple(person_ids),))
-        person_to_update_in_es = [Person(
-            id=person[0],
-            full_name=person[1],
-            roles=person[2],
-            birth_date=person[3],
-            film_ids=person[4])
-            for person in person_from_pg]
-
-        loader.send(person_to_update_in_es)
-        logging.info(f"merge data")
+        objects: list = (yield)
+        changed, new_hashes = hashes.filter_changed(table, objects)
+        BULK_DOCUMENTS.labels(table, 'skipped').inc(len(objects) - len(changed))
+        if len(changed) < len(objects):
+            logging.info(f"skip {len(objects) - len(changed)} unchanged documents in '{table}' index")
+        if not changed:
+            continue
+        with STAGE_SECONDS.labels('load', table).time():
+            failed_ids = es.bulk_update(changed, table)
+        BULK_DOCUMENTS.labels(table, 'indexed').inc(len(changed) - len(failed_ids))
+        BULK_DOCUMENTS.labels(table, 'failed').inc(len(failed_ids))
+        hashes.store(table, {doc_id: doc_hash for doc_id, doc_hash in new_hashes.items() if doc_id not in failed_ids})
+        if table == 'film_work':
+            api_cache.invalidate(str(doc.id) for doc in changed if str(doc.id) not in failed_ids)
+        logging.info(f"load data to elasticSearch")
 
 
 @coroutine
-def load(table: str):
-    """Корутина принимает порции данных с кинопроизведениями и сохраняет в elasticSearch."""
+def remove(table: str):
+    """Корутина принимает порции id удаленных объектов и удаляет их документы из elasticSearch."""
     while True:
-        objects: list = (yield)
-        es = ElasticSearchConnector()
-        es.bulk_update(objects, table)
-        logging.info(f"load data to elasticSearch")
+        ids: list = (yield)
+        with STAGE_SECONDS.labels('remove', table).time():
+            failed_ids = es.bulk_delete(ids, table)
+        BULK_DOCUMENTS.labels(table, 'deleted').inc(len(ids) - len(failed_ids))
+        BULK_DOCUMENTS.labels(table, 'failed').inc(len(failed_ids))
+        removed = [str(doc_id) for doc_id in ids if str(doc_id) not in failed_ids]
+        hashes.forget(table, removed)
+        if table == 'film_work':
+            api_cache.invalidate(removed)
+        logging.info(f"delete data from elasticSearch")
 
 
-def start():
-    tables = ['film_work', 'genre', 'person']
+class PipelineAborted(Exception):
+    """Цепочка закрывается из-за ошибки, буферы не досылаются."""
+
+
+class Pipeline:
+    """
+    Цепочка корутин ETL, которая собирается один раз на запуск и через которую проходят
+    все страницы всех таблиц. Корутины, соединения с БД и elasticSearch не пересоздаются
+    на каждой странице.
+
+    Корутины закрываются от источника к приемнику: так данные, которые стадия досылает
+    при закрытии, успевают пройти через еще открытые стадии ниже по цепочке.
+    """
+
+    def __init__(self):
+        self.film_loader = load('film_work')
+        self.film_merger = merge(self.film_loader, 'film_work')
+        self.film_accumulator = accumulate(self.film_merger)
+        self.loaders = {table: load(table) for table in ('genre', 'person')}
+        self.mergers = {table: merge(self.loaders[table], table) for table in ('genre', 'person')}
+        self.denormalizers = {table: denormalize(self.film_accumulator, self.loaders[table], table)
+                              for table in ('genre', 'person')}
+        self.removers = {table: remove(table) for table in TABLES}
+
+    def send(self, table: str, ids: list):
+        """Функция передает id измененных объектов таблицы в начало цепочки."""
+        if table == 'film_work':
+            self.film_accumulator.send(ids)
+        elif table in self.denormalizers:
+            self.denormalizers[table].send(ids)
+        else:
+            logging.error(f"No '{table}' table")
+
+    def merge(self, table: str, ids: list):
+        """
+        Функция передает id сразу на сборку документов индекса таблицы, без поиска
+        связанных кинопроизведений.
+        """
+        if table == 'film_work':
+            self.film_accumulator.send(ids)
+        else:
+            self.mergers[table].send(ids)
+
+    def delete(self, table: str, ids: list):
+        """Функция удаляет документы удаленных объектов таблицы из индекса."""
+        self.removers[table].send(ids)
+
+    def flush(self):
+        """Функция отправляет дальше по цепочке все id, накопленные в буферах."""
+        self.film_accumulator.send(None)
+
+    def checkpoint(self):
+        """
+        Функция сбрасывает буферы и сохраняет курсоры: загрузка в elasticSearch идет синхронно,
+        поэтому после flush все данные до накопленных курсоров уже подтверждены.
+        """
+        self.flush()
+        checkpoint.commit()
+
+    def close(self, abort: bool = False):
+        """
+        Функция закрывает корутины цепочки от источника к приемнику и сохраняет курсоры.
+
+        Если цепочка закрывается из-за ошибки (abort), накопленные id не досылаются и курсоры
+        не сохраняются: стадии могли остановиться на ошибке, а данные до курсоров - не дойти
+        до elasticSearch. После перезапуска они будут прочитаны снова.
+        """
+        if abort:
+            try:
+                self.film_accumulator.throw(PipelineAborted)
+            except PipelineAborted:
+                pass
+        stages = [*self.denormalizers.values(), *self.mergers.values(), self.film_accumulator, self.film_merger,
+                  *self.loaders.values(), self.film_loader, *self.removers.values()]
+        for stage in stages:
+            stage.close()
+        if not abort:
+            checkpoint.commit()
+
+    def __enter__(self) -> 'Pipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(abort=exc_type is not None)
+
+
+def consume_changes(pipeline: Pipeline):
+    """
+    Функция вычитывает журнал изменений content.change_log пачками и передает изменения в pipeline:
+
+    - изменение кинопроизведения пересобирает его документ;
+    - изменение жанра или персоналии пересобирает ее документ и документы связанных кинопроизведений;
+    - удаление кинопроизведения, жанра или персоналии удаляет ее документ из индекса;
+    - изменение в таблице связей пересобирает только затронутое кинопроизведение и персоналию.
+
+    Записи журнала удаляются только после того, как pipeline сброшен и загрузка подтверждена.
+
+    Когда журнал вычитан до конца, курсоры опроса по updated_at сдвигаются на время начала
+    вычитки: все изменения, закоммиченные до него, уже прошли через журнал. Иначе редкий
+    резервный опрос заново перечитал бы все изменения с момента запуска ETL.
+    """
+    drained_at = pg.query(NOW_QUERY, ())[0][0]
     while True:
-        for table in tables:
-            produce(table)
-            sleep(FETCH_DELAY)
+        with STAGE_SECONDS.labels('extract', 'change_log').time():
+            changes = pg.query(CHANGES_QUERY, (LIMIT,))
+        ROWS.labels('extract', 'change_log').inc(len(changes))
+        if not changes:
+            break
+        logging.info(f"got {len(changes)} changes from change log")
+        # Для каждого объекта важна только последняя операция в пачке.
+        operations = {table: {} for table in TABLES}
+        linked = {table: {} for table in TABLES}
+        for _, table_name, operation, object_id, film_work_id in changes:
+            if table_name in TABLES:
+                operations[table_name].pop(object_id, None)
+                operations[table_name][object_id] = operation
+            else:
+                linked['film_work'][film_work_id] = None
+                linked[table_name.replace('_film_work', '')][object_id] = None
+
+        for table in TABLES:
+            deleted = [object_id for object_id, operation in operations[table].items() if operation == 'DELETE']
+            changed = [object_id for object_id, operation in operations[table].items() if operation != 'DELETE']
+            if deleted:
+                pipeline.delete(table, deleted)
+            if changed:
+                pipeline.send(table, changed)
+        linked_films = [film_id for film_id in linked['film_work'] if operations['film_work'].get(film_id) != 'DELETE']
+        if linked_films:
+            pipeline.merge('film_work', linked_films)
+        # Документ персоналии хранит ее роли и фильмы, документ жанра от связей не зависит.
+        linked_persons = [person_id for person_id in linked['person']
+                          if operations['person'].get(person_id) != 'DELETE']
+        if linked_persons:
+            pipeline.merge('person', linked_persons)
+
+        pipeline.checkpoint()
+        pg.execute(PURGE_CHANGES_QUERY, ([change[0] for change in changes],))
+
+    for table in TABLES:
+        if get_cursor(table)[0] < drained_at:
+            checkpoint.stage(table, drained_at, START_CRAWL_ID)
+    pipeline.checkpoint()
+
+
+def poll(pipeline: Pipeline):
+    """Функция один раз опрашивает все таблицы по updated_at."""
+    for table in TABLES:
+        produce(table, pipeline)
+        sleep(FETCH_DELAY)
+    pipeline.checkpoint()
+
+
+def start():
+    """
+    Если журнал изменений включен и есть в БД, ETL ждет уведомлений и вычитывает журнал,
+    а опрос таблиц по updated_at выполняется при запуске и когда уведомлений не было
+    CHANGE_FEED_FALLBACK_INTERVAL секунд. Иначе ETL постоянно опрашивает таблицы.
+
+    При запуске ETL включает или выключает запись журнала триггерами и передает им канал
+    уведомлений. Выключенный журнал очищается: читать его некому.
+    """
+    es.ensure_indices()
+    if METRICS_ENABLED:
+        watch_crawl_lag(TABLES, get_cursor)
+        start_metrics_server(METRICS_PORT)
+    feed = None
+    if pg.query(CHANGE_FEED_EXISTS_QUERY, ())[0][0]:
+        pg.execute(CHANGE_FEED_SETTINGS_QUERY, (CHANGE_FEED_ENABLED, CHANGE_FEED_CHANNEL))
+        if CHANGE_FEED_ENABLED:
+            feed = ChangeFeed()
+        else:
+            pg.execute(CLEAR_CHANGES_QUERY, ())
+    elif CHANGE_FEED_ENABLED:
+        logging.warning("content.change_feed_settings not found, fall back to polling")
+    with Pipeline() as pipeline:
+        poll(pipeline)
+        if feed is not None:
+            consume_changes(pipeline)
+        while True:
+            if feed is None:
+                poll(pipeline)
+            elif feed.wait(CHANGE_FEED_FALLBACK_INTERVAL):
+                consume_changes(pipeline)
+            else:
+                poll(pipeline)
 
 
 if __name__ == '__main__':
@@ -233,4 +442,8 @@ if __name__ == '__main__':
                         format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     logger = logging.getLogger(__name__)
     logger.addHandler(logging.StreamHandler())
-    start()
+    if ETL_RUNNER == 'async':
+        from async_etl import start as start_async
+        asyncio.run(start_async())
+    else:
+        start()
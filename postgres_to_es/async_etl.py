@@ -0,0 +1,195 @@
+import asyncio
+import logging
+
+from config import (LIMIT, FETCH_DELAY, ASYNC_QUEUE_SIZE, EXTRACT_MODE, DOCUMENT_HASHES_PATH, METRICS_ENABLED,
+                    METRICS_PORT, CHANGE_FEED_CHANNEL, API_CACHE_URL, API_CACHE_KEY_PREFIX, API_CACHE_VERSION)
+from utils.api_cache import ApiCache
+from utils.async_utils import AsyncPostgresConnector, AsyncElasticSearchConnector
+from utils.cursors import START_CRAWL_ID, Checkpoint, get_cursor, state
+from utils.hashes import DocumentHashes
+from utils.metrics import BULK_DOCUMENTS, STAGE_SECONDS, ROWS, start_metrics_server, watch_crawl_lag
+from utils.queries import (CHANGED_ROWS_QUERY, LINKED_FILMS_QUERY, FILMS_QUERY, GENRES_QUERY, PERSONS_QUERY,
+                           RAW_DOCUMENT_QUERIES, STORED_DOCUMENT_QUERIES, STORED_POLL_TABLES, CHANGE_FEED_EXISTS_QUERY,
+                           CHANGE_FEED_SETTINGS_QUERY, CLEAR_CHANGES_QUERY)
+from utils.transform import to_film_work, to_genre, to_person, to_raw_document
+
+pg = AsyncPostgresConnector()
+hashes = DocumentHashes(DOCUMENT_HASHES_PATH)
+es = AsyncElasticSearchConnector(hashes)
+api_cache = ApiCache(API_CACHE_URL, API_CACHE_KEY_PREFIX, API_CACHE_VERSION)
+
+# Таблица, изменения которой опрашиваются по updated_at вместо самой таблицы, как в ETL.py.
+POLL_TABLES = STORED_POLL_TABLES if EXTRACT_MODE == 'stored' else {}
+
+if EXTRACT_MODE == 'raw':
+    MERGE_QUERIES = {table: (RAW_DOCUMENT_QUERIES[table], to_raw_document) for table in RAW_DOCUMENT_QUERIES}
+elif EXTRACT_MODE == 'stored':
+    MERGE_QUERIES = {table: (STORED_DOCUMENT_QUERIES[table], to_raw_document) for table in STORED_DOCUMENT_QUERIES}
+else:
+    MERGE_QUERIES = {
+        'film_work': (FILMS_QUERY, to_film_work),
+        'genre': (GENRES_QUERY, to_genre),
+        'person': (PERSONS_QUERY, to_person),
+    }
+
+
+async def produce(table: str, ids_queue: asyncio.Queue, checkpoint: Checkpoint):
+    """
+    Функция постранично собирает id измененных сущностей в таблице БД по курсору (updated_at, id)
+    и кладет их в ограниченную очередь. Пока следующие стадии обрабатывают страницу N,
+    producer уже читает страницу N+1, а при заполненной очереди ждет.
+
+    :param table: таблица в БД в которой ведется поиск
+    :param ids_queue: очередь id для transformer
+    :param checkpoint: курсоры таблицы, ожидающие подтверждения загрузки
+    """
+    last_crawl_time, last_crawl_id = get_cursor(table)
+    while True:
+        with STAGE_SECONDS.labels('extract', table).time():
+            data_chunk = await pg.query(CHANGED_ROWS_QUERY.format(table=POLL_TABLES.get(table, table)),
+                                        (last_crawl_time, last_crawl_id, LIMIT))
+        ROWS.labels('extract', table).inc(len(data_chunk))
+        if not data_chunk:
+            break
+        logging.info(f"got changed data in '{table}' table")
+        last_crawl_id, last_crawl_time = data_chunk[-1]
+        await ids_queue.put([item[0] for item in data_chunk])
+        checkpoint.stage(table, last_crawl_time, last_crawl_id)
+
+
+async def enrich(table: str, ids: list):
+    """
+    Асинхронный генератор постранично отдает id кинопроизведений, которых коснулись
+    изменения объектов ids из таблицы table.
+    """
+    last_film_id = START_CRAWL_ID
+    while True:
+        with STAGE_SECONDS.labels('enrich', table).time():
+            data_chunk = await pg.query(LINKED_FILMS_QUERY.format(table=table), (ids, last_film_id, LIMIT))
+        ROWS.labels('enrich', table).inc(len(data_chunk))
+        if not data_chunk:
+            break
+        logging.info(f"enrich data from producer")
+        yield [item[0] for item in data_chunk]
+        last_film_id = data_chunk[-1][0]
+
+
+async def merge(table: str, ids: list) -> list:
+    """Функция собирает из БД документы для индекса таблицы table по списку id."""
+    sql, transform = MERGE_QUERIES[table]
+    with STAGE_SECONDS.labels('merge', table).time():
+        rows = await pg.query(sql, (ids,))
+        docs = [transform(row) for row in rows]
+    ROWS.labels('merge', table).inc(len(docs))
+    logging.info(f"merge data")
+    return docs
+
+
+async def transform(table: str, ids_queue: asyncio.Queue, docs_queue: asyncio.Queue):
+    """
+    Задача берет id из очереди producer, при необходимости находит связанные кинопроизведения
+    и кладет собранные документы в очередь loader.
+    """
+    while True:
+        ids = await ids_queue.get()
+        try:
+            if table != 'film_work':
+                async for film_ids in enrich(table, ids):
+                    await docs_queue.put(('film_work', await merge('film_work', film_ids)))
+            await docs_queue.put((table, await merge(table, ids)))
+        finally:
+            ids_queue.task_done()
+
+
+async def load(docs_queue: asyncio.Queue):
+    """
+    Задача берет порции документов из очереди и сохраняет в elasticSearch те из них,
+    содержимое которых изменилось с последней загрузки. После загрузки кинопроизведений
+    их ответы сбрасываются в кэше API.
+    """
+    while True:
+        table, docs = await docs_queue.get()
+        try:
+            changed, new_hashes = hashes.filter_changed(table, docs)
+            BULK_DOCUMENTS.labels(table, 'skipped').inc(len(docs) - len(changed))
+            if changed:
+                with STAGE_SECONDS.labels('load', table).time():
+                    failed_ids = await es.bulk_update(changed, table)
+                BULK_DOCUMENTS.labels(table, 'indexed').inc(len(changed) - len(failed_ids))
+                BULK_DOCUMENTS.labels(table, 'failed').inc(len(failed_ids))
+                hashes.store(table, {doc_id: doc_hash for doc_id, doc_hash in new_hashes.items()
+                                     if doc_id not in failed_ids})
+                if table == 'film_work':
+                    api_cache.invalidate(str(doc.id) for doc in changed if str(doc.id) not in failed_ids)
+                logging.info(f"load data to elasticSearch")
+        finally:
+            docs_queue.task_done()
+
+
+async def supervise(awaitable, workers: list):
+    """
+    Функция ждет awaitable, следя за задачами workers: если задача упала раньше, ожидание
+    отменяется и ошибка задачи пробрасывается. Иначе join очереди, которую разбирала
+    упавшая задача, ждал бы вечно.
+    """
+    main = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait([main, *workers], return_when=asyncio.FIRST_COMPLETED)
+    if main in done:
+        return main.result()
+    main.cancel()
+    await asyncio.gather(main, return_exceptions=True)
+    for worker in done:
+        worker.result()
+    raise RuntimeError("ETL worker stopped unexpectedly")
+
+
+async def run_table(table: str, once: bool = False):
+    """
+    Функция бесконечно (или один раз, если once) опрашивает одну таблицу. Стадии extract, transform и load работают
+    отдельными задачами и связаны ограниченными очередями, поэтому ожидания ответов
+    Postgres и elasticSearch перекрываются. Курсор таблицы сохраняется после того,
+    как все очереди обработаны. Если задача transform или load упала, run_table завершается
+    с ее ошибкой, и курсор не сохраняется.
+    """
+    checkpoint = Checkpoint(state)
+    ids_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    docs_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    workers = [asyncio.create_task(transform(table, ids_queue, docs_queue)),
+               asyncio.create_task(load(docs_queue))]
+    try:
+        while True:
+            await supervise(produce(table, ids_queue, checkpoint), workers)
+            await supervise(ids_queue.join(), workers)
+            await supervise(docs_queue.join(), workers)
+            checkpoint.commit()
+            if once:
+                break
+            await asyncio.sleep(FETCH_DELAY)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def start(once: bool = False):
+    """
+    Асинхронный runner: все таблицы обрабатываются одновременно.
+
+    :param once: прочитать изменения один раз и завершиться (используется в бенчмарках)
+    """
+    tables = ['film_work', 'genre', 'person']
+    if METRICS_ENABLED:
+        watch_crawl_lag(tables, get_cursor)
+        start_metrics_server(METRICS_PORT)
+    await pg.connect()
+    try:
+        # Асинхронный runner журнал изменений не читает, поэтому выключает и очищает его.
+        if (await pg.query(CHANGE_FEED_EXISTS_QUERY, ()))[0][0]:
+            await pg.query(CHANGE_FEED_SETTINGS_QUERY, (False, CHANGE_FEED_CHANNEL))
+            await pg.query(CLEAR_CHANGES_QUERY, ())
+        for table in tables:
+            await es.ensure_index(table)
+        await asyncio.gather(*(run_table(table, once) for table in tables))
+    finally:
+        await pg.close()
+        await es.close()
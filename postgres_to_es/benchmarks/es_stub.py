@@ -0,0 +1,171 @@
+"""
+Локальная замена elasticSearch для бенчмарков ETL.
+
+Сервер отвечает на запросы, которые делает ETL (создание индексов и алиасов, настройки,
+refresh/forcemerge, _bulk), считает полученные документы и байты, но ничего не индексирует.
+Так бенчмарк измеряет Postgres, трансформацию и сериализацию, а не скорость кластера.
+Задержка ответа на _bulk (--bulk-latency) позволяет смоделировать медленный кластер.
+
+    python -m benchmarks.es_stub --port 9201
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+INFO = {
+    "name": "es-stub",
+    "cluster_name": "benchmark",
+    "version": {"number": "7.15.0", "build_flavor": "default", "lucene_version": "8.9.0"},
+    "tagline": "You Know, for Search",
+}
+ACKNOWLEDGED = {"acknowledged": True}
+
+
+class StubState:
+    """Индексы, алиасы и счетчики заглушки; общие для всех потоков сервера."""
+
+    def __init__(self, bulk_latency: float = 0.0):
+        self.bulk_latency = bulk_latency
+        self.lock = threading.Lock()
+        self.indices: Set[str] = set()
+        self.aliases: Dict[str, Set[str]] = {}
+        self.stats = {'bulk_requests': 0, 'bulk_bytes': 0, 'indexed': 0, 'deleted': 0}
+
+    def resolve(self, name: str) -> Set[str]:
+        return set(self.aliases.get(name, ())) or ({name} if name in self.indices else set())
+
+    def update_aliases(self, actions: list):
+        for action in actions:
+            (op, params), = action.items()
+            if op == 'add':
+                self.aliases.setdefault(params['alias'], set()).add(params['index'])
+            elif op == 'remove':
+                self.aliases.get(params['alias'], set()).discard(params['index'])
+            elif op == 'remove_index':
+                self.indices.discard(params['index'])
+
+    def bulk(self, body: bytes) -> dict:
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            if not line.strip():
+                continue
+            (op_type, meta), = json.loads(line).items()
+            if op_type != 'delete':
+                next(lines, None)
+            counter = 'deleted' if op_type == 'delete' else 'indexed'
+            self.stats[counter] += 1
+            items.append({op_type: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 200,
+                                    'result': 'deleted' if op_type == 'delete' else 'updated'}})
+        self.stats['bulk_requests'] += 1
+        self.stats['bulk_bytes'] += len(body)
+        return {'took': 1, 'errors': False, 'items': items}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: StubState
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def respond(self, status: int, payload: Optional[dict] = None):
+        body = json.dumps(payload).encode() if payload is not None and self.command != 'HEAD' else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self) -> Tuple[str, list]:
+        return self.command, [part for part in urlsplit(self.path).path.split('/') if part]
+
+    def do_HEAD(self):
+        _, parts = self.route()
+        with self.state.lock:
+            if parts[:1] == ['_alias']:
+                exists = parts[1] in self.state.aliases and bool(self.state.aliases[parts[1]])
+            else:
+                exists = bool(self.state.resolve(parts[0]))
+        self.respond(200 if exists else 404, {})
+
+    def do_GET(self):
+        _, parts = self.route()
+        if not parts:
+            return self.respond(200, INFO)
+        if parts == ['_stub', 'stats']:
+            with self.state.lock:
+                return self.respond(200, dict(self.state.stats))
+        if parts[:1] == ['_alias']:
+            with self.state.lock:
+                indices = self.state.aliases.get(parts[1], set())
+            return self.respond(200 if indices else 404, {index: {'aliases': {parts[1]: {}}} for index in indices})
+        self.respond(200, {})
+
+    def do_PUT(self):
+        _, parts = self.route()
+        body = self.read_body()
+        if len(parts) == 1:
+            payload = json.loads(body or b'{}')
+            with self.state.lock:
+                self.state.indices.add(parts[0])
+                for alias in payload.get('aliases', {}):
+                    self.state.aliases.setdefault(alias, set()).add(parts[0])
+            return self.respond(200, {**ACKNOWLEDGED, 'index': parts[0]})
+        self.respond(200, ACKNOWLEDGED)
+
+    def do_POST(self):
+        _, parts = self.route()
+        body = self.read_body()
+        if parts[-1:] == ['_bulk']:
+            if self.state.bulk_latency:
+                time.sleep(self.state.bulk_latency)
+            with self.state.lock:
+                return self.respond(200, self.state.bulk(body))
+        if parts == ['_aliases']:
+            with self.state.lock:
+                self.state.update_aliases(json.loads(body)['actions'])
+            return self.respond(200, ACKNOWLEDGED)
+        self.respond(200, {**ACKNOWLEDGED, '_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+
+    def do_DELETE(self):
+        _, parts = self.route()
+        self.read_body()
+        with self.state.lock:
+            self.state.indices.discard(parts[0])
+            for indices in self.state.aliases.values():
+                indices.discard(parts[0])
+        self.respond(200, ACKNOWLEDGED)
+
+
+def serve(port: int, bulk_latency: float = 0.0) -> ThreadingHTTPServer:
+    """Функция запускает заглушку в фоновом потоке и возвращает сервер."""
+    handler = type('BoundStubHandler', (StubHandler,), {'state': StubState(bulk_latency)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--bulk-latency', type=float, default=0.0, help="задержка ответа на _bulk в секундах")
+    args = parser.parse_args()
+    server = serve(args.port, args.bulk_latency)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
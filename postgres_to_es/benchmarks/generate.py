@@ -0,0 +1,148 @@
+"""
+Генератор синтетических данных схемы content для бенчмарков ETL.
+
+Схема создается из etc/db/db_schema.sql, данные генерируются на стороне Postgres
+(generate_series), поэтому миллион кинопроизведений создается за минуты, а не часы.
+id детерминированы (md5 от номера), а setseed делает случайные значения воспроизводимыми.
+
+Участие персоналий в фильмах распределено по степенному закону: номер персоналии равен
+persons * random() ^ skew, поэтому немногие персоналии снимаются в тысячах фильмов,
+а большинство - в одном-двух, как в реальном каталоге.
+
+Запуск из каталога postgres_to_es (параметры подключения - переменные POSTGRES_*):
+
+    python -m benchmarks.generate --films 10000
+    python -m benchmarks.generate --touch 0.01
+"""
+import argparse
+import logging
+import os
+from datetime import datetime
+
+import psycopg2
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'etc', 'db', 'db_schema.sql')
+
+GENERATE_QUERIES = [
+    '''SELECT setseed(%(seed)s);''',
+    '''TRUNCATE content.genre_film_work, content.person_film_work, content.genre, content.person,
+                content.film_work;''',
+    '''
+    INSERT INTO content.genre (id, name, description, created_at, updated_at)
+    SELECT md5('genre' || n)::uuid, 'Genre ' || n, 'Synthetic genre ' || n,
+           now() - interval '400 days', now() - random() * interval '365 days'
+    FROM generate_series(1, %(genres)s) n;
+    ''',
+    '''
+    INSERT INTO content.film_work (id, title, description, creation_date, rating, type, created_at, updated_at)
+    SELECT md5('film' || n)::uuid, 'Film ' || n, repeat('Synthetic film description. ', 10),
+           date '1950-01-01' + (random() * 25000)::int, round((random() * 10)::numeric, 1),
+           CASE WHEN random() < 0.8 THEN 'movie' ELSE 'tv_show' END,
+           now() - interval '400 days', now() - random() * interval '365 days'
+    FROM generate_series(1, %(films)s) n;
+    ''',
+    '''
+    INSERT INTO content.person (id, full_name, birth_date, created_at, updated_at)
+    SELECT md5('person' || n)::uuid, 'Person ' || n, date '1930-01-01' + (random() * 25000)::int,
+           now() - interval '400 days', now() - random() * interval '365 days'
+    FROM generate_series(1, %(persons)s) n;
+    ''',
+    '''
+    INSERT INTO content.person_film_work (film_work_id, person_id, role, created_at)
+    SELECT md5('film' || f)::uuid,
+           md5('person' || (1 + floor(%(persons)s * power(random(), %(skew)s)))::int)::uuid,
+           r.role, now()
+    FROM generate_series(1, %(films)s) f
+    CROSS JOIN unnest(array_fill('actor'::text, ARRAY[%(actors)s]) || ARRAY['director', 'writer', 'writer']) r(role)
+    ON CONFLICT DO NOTHING;
+    ''',
+    '''
+    INSERT INTO content.genre_film_work (film_work_id, genre_id, created_at)
+    SELECT md5('film' || f)::uuid,
+           md5('genre' || (1 + floor(%(genres)s * power(random(), 2)))::int)::uuid,
+           now()
+    FROM generate_series(1, %(films)s) f
+    CROSS JOIN generate_series(1, 3) g
+    WHERE g = 1 OR random() < 0.5
+    ON CONFLICT DO NOTHING;
+    ''',
+    '''ANALYZE;''',
+]
+
+TOUCH_QUERY = '''
+UPDATE content.{table}
+SET {column} = CASE WHEN right({column}, 2) = ' *' THEN left({column}, -2) ELSE {column} || ' *' END,
+    updated_at = now()
+WHERE random() < %s;
+'''
+TOUCH_COLUMNS = {'film_work': 'title', 'genre': 'name', 'person': 'full_name'}
+
+
+def get_dsn(args: argparse.Namespace) -> dict:
+    return {"dbname": os.environ.get('POSTGRES_DB'),
+            "user": os.environ.get('POSTGRES_USER'),
+            "password": os.environ.get('POSTGRES_PASSWORD'),
+            "host": args.pg_host,
+            "port": args.pg_port}
+
+
+def generate(dsn: dict, films: int, persons: int, genres: int, actors: int, skew: float, seed: float,
+             with_schema: bool = True):
+    """Функция создает схему content и заполняет ее синтетическими данными."""
+    params = {'films': films, 'persons': persons, 'genres': genres, 'actors': actors, 'skew': skew, 'seed': seed}
+    with psycopg2.connect(**dsn) as connection, connection.cursor() as cur:
+        if with_schema:
+            with open(SCHEMA_PATH) as f:
+                cur.execute(f.read())
+        for sql in GENERATE_QUERIES:
+            cur.execute(sql, params)
+    logging.info(f"generated {films} films, {persons} persons, {genres} genres")
+
+
+def touch(dsn: dict, fraction: float, seed: float) -> datetime:
+    """
+    Функция правит название у доли fraction строк всех таблиц, как это делают правки в админке.
+    Меняется содержимое, а не только updated_at: в режиме stored документ кинопроизведения
+    обновляется триггером лишь при изменении содержимого. Метка ' *' ставится и снимается
+    при повторных вызовах, поэтому названия не растут.
+
+    :return: время перед обновлением - курсор, с которого инкрементальный ETL увидит только эти изменения
+    """
+    with psycopg2.connect(**dsn) as connection, connection.cursor() as cur:
+        cur.execute("SELECT now(), setseed(%s);", (seed,))
+        since = cur.fetchone()[0]
+        for table, column in TOUCH_COLUMNS.items():
+            cur.execute(TOUCH_QUERY.format(table=table, column=column), (fraction,))
+            logging.info(f"touched {cur.rowcount} rows in '{table}' table")
+    return since
+
+
+def add_connection_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--pg-host', default=os.environ.get('POSTGRES_HOST', '127.0.0.1'))
+    parser.add_argument('--pg-port', type=int, default=int(os.environ.get('POSTGRES_PORT', 5432)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_connection_arguments(parser)
+    parser.add_argument('--films', type=int, default=10000, help="число кинопроизведений")
+    parser.add_argument('--persons', type=int, help="число персоналий, по умолчанию половина числа фильмов")
+    parser.add_argument('--genres', type=int, default=30, help="число жанров")
+    parser.add_argument('--actors', type=int, default=8, help="актеров в фильме")
+    parser.add_argument('--skew', type=float, default=3.0, help="показатель степенного распределения персоналий")
+    parser.add_argument('--seed', type=float, default=0.42, help="seed для random() в Postgres, от -1 до 1")
+    parser.add_argument('--no-schema', action='store_true', help="не выполнять db_schema.sql")
+    parser.add_argument('--touch', type=float, help="вместо генерации изменить названия у доли строк")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    dsn = get_dsn(args)
+    if args.touch is not None:
+        print(touch(dsn, args.touch, args.seed).isoformat())
+        return
+    generate(dsn, args.films, args.persons or max(args.films // 2, 1), args.genres, args.actors, args.skew, args.seed,
+             with_schema=not args.no_schema)
+
+
+if __name__ == '__main__':
+    main()
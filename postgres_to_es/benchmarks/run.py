@@ -0,0 +1,127 @@
+"""
+Бенчмарк ETL: прогоняет сценарии с разными LIMIT, runner и extract_mode против локального
+Postgres и заглушки elasticSearch (benchmarks.es_stub) и печатает docs/sec, пиковую память
+и время по стадиям.
+
+Данные нужно предварительно сгенерировать (benchmarks.generate). Каждый замер запускается
+в отдельном процессе со своим config.json и файлом состояния во временном каталоге; перед
+замером incremental обновляется updated_at у доли строк --touch, и курсор ставится на время
+перед обновлением. Запуск из каталога postgres_to_es:
+
+    python -m benchmarks.generate --films 100000
+    python -m benchmarks.run --modes backfill incremental --limits 100 500 1000 --extract-modes objects raw
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import urllib.request
+
+from benchmarks.es_stub import serve
+from benchmarks.generate import add_connection_arguments, get_dsn, touch
+
+ETL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = ['film_work', 'genre', 'person']
+START_CRAWL_ID = '00000000-0000-0000-0000-000000000000'
+
+
+def make_config(args: argparse.Namespace, workdir: str, limit: int, runner: str, extract_mode: str) -> dict:
+    """Функция собирает config.json сценария из основного config.json: меняются только параметры замера."""
+    with open(os.path.join(ETL_DIR, 'config.json')) as f:
+        config = json.load(f)
+    config['film_work_pg']['dsn'] = {'host': args.pg_host, 'port': args.pg_port}
+    config['film_work_pg']['limit'] = limit
+    config['film_work_pg']['fetch_delay'] = 0
+    config['film_work_es']['dsn'] = {'host': '127.0.0.1', 'port': args.stub_port}
+    config['runner'] = runner
+    config['extract_mode'] = extract_mode
+    config['change_feed'] = {**config.get('change_feed', {}), 'enabled': False}
+    config['document_hashes'] = {**config.get('document_hashes', {}), 'enabled': False}
+    config['metrics'] = {**config.get('metrics', {}), 'enabled': False}
+    config['state_file_path'] = os.path.join(workdir, 'state_storage.json')
+    config['state_storage'] = {**config.get('state_storage', {}), 'backend': 'json'}
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    return config
+
+
+def get_stub_stats(port: int) -> dict:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stub/stats') as response:
+        return json.load(response)
+
+
+def run_scenario(args: argparse.Namespace, mode: str, limit: int, runner: str, extract_mode: str) -> dict:
+    with tempfile.TemporaryDirectory(prefix='etl_bench_') as workdir:
+        config = make_config(args, workdir, limit, runner, extract_mode)
+        if mode == 'incremental':
+            since = touch(get_dsn(args), args.touch, args.seed).isoformat()
+            state = {}
+            for table in TABLES:
+                state.update({f"last_{table}_crawl_time": since, f"last_{table}_crawl_id": START_CRAWL_ID})
+            with open(config['state_file_path'], 'w') as f:
+                json.dump(state, f)
+
+        before = get_stub_stats(args.stub_port)
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ETL_DIR, os.environ.get('PYTHONPATH')]))}
+        completed = subprocess.run([sys.executable, '-m', 'benchmarks.scenario', '--mode', mode,
+                                    '--workers', str(args.workers)],
+                                   cwd=workdir, env=env, check=True, stdout=subprocess.PIPE, text=True)
+        after = get_stub_stats(args.stub_port)
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    docs = after['indexed'] - before['indexed']
+    return {'mode': mode, 'runner': runner, 'extract_mode': extract_mode, 'limit': limit, 'docs': docs,
+            'docs_per_sec': docs / result['seconds'] if result['seconds'] else 0.0,
+            'bulk_requests': after['bulk_requests'] - before['bulk_requests'],
+            'bulk_mb': (after['bulk_bytes'] - before['bulk_bytes']) / 2 ** 20, **result}
+
+
+def format_result(result: dict) -> str:
+    stages = ' '.join(f"{stage}={totals['seconds']:.2f}s/{totals['batches']}"
+                      for stage, totals in sorted(result['stages'].items()))
+    return (f"{result['mode']:<12} {result['runner']:<6} {result['extract_mode']:<8} {result['limit']:>6} "
+            f"{result['docs']:>9} {result['seconds']:>8.1f} {result['docs_per_sec']:>9.0f} "
+            f"{result['peak_rss_mb']:>8.0f}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_connection_arguments(parser)
+    parser.add_argument('--modes', nargs='+', choices=['backfill', 'incremental', 'reindex'],
+                        default=['backfill', 'incremental'])
+    parser.add_argument('--limits', nargs='+', type=int, default=[100, 500, 1000])
+    parser.add_argument('--runners', nargs='+', choices=['sync', 'async'], default=['sync'])
+    parser.add_argument('--extract-modes', nargs='+', choices=['objects', 'raw', 'stored'], default=['objects', 'raw'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="процессов для режима reindex")
+    parser.add_argument('--touch', type=float, default=0.01, help="доля строк, изменяемых для режима incremental")
+    parser.add_argument('--seed', type=float, default=0.42)
+    parser.add_argument('--stub-port', type=int, default=9201)
+    parser.add_argument('--bulk-latency', type=float, default=0.0, help="задержка ответа заглушки на _bulk")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    server = serve(args.stub_port, args.bulk_latency)
+    results = []
+    print(f"{'mode':<12} {'runner':<6} {'extract':<8} {'limit':>6} {'docs':>9} {'seconds':>8} {'docs/s':>9} "
+          f"{'rss, MB':>8}  stages (seconds/batches)")
+    try:
+        for mode, runner, extract_mode, limit in itertools.product(args.modes, args.runners, args.extract_modes,
+                                                                   args.limits):
+            if mode == 'reindex' and runner != args.runners[0]:
+                # Переиндексация не зависит от runner.
+                continue
+            result = run_scenario(args, mode, limit, runner, extract_mode)
+            results.append(result)
+            print(format_result(result), flush=True)
+    finally:
+        server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Один замер бенчмарка ETL. Запускается из benchmarks.run в отдельном процессе, в каталоге
+с config.json сценария, чтобы настройки (LIMIT, runner, extract_mode) и пиковая память
+не переходили из одного замера в другой. Результат печатается последней строкой в JSON.
+
+Режимы:
+- backfill - один проход основного ETL по всем таблицам с пустым состоянием;
+- incremental - один проход основного ETL с курсором из состояния (только свежие изменения);
+- reindex - параллельная переиндексация reindex.py.
+"""
+import argparse
+import asyncio
+import json
+import resource
+from time import perf_counter
+
+
+def stage_timings() -> dict:
+    """Функция суммирует метрику etl_stage_duration_seconds по стадиям."""
+    from prometheus_client import REGISTRY
+    stages = {}
+    for metric in REGISTRY.collect():
+        if metric.name != 'etl_stage_duration_seconds':
+            continue
+        for sample in metric.samples:
+            totals = stages.setdefault(sample.labels['stage'], {'seconds': 0.0, 'batches': 0})
+            if sample.name.endswith('_sum'):
+                totals['seconds'] += sample.value
+            elif sample.name.endswith('_count'):
+                totals['batches'] += int(sample.value)
+    return stages
+
+
+def get_runner(mode: str, workers: int):
+    """Функция импортирует модули ETL заранее, чтобы импорт и подключения не попали в замер."""
+    if mode == 'reindex':
+        from reindex import reindex
+        return lambda: reindex(workers)
+
+    from config import ETL_RUNNER
+    if ETL_RUNNER == 'async':
+        from async_etl import start
+        return lambda: asyncio.run(start(once=True))
+
+    from ETL import Pipeline, es, poll
+
+    def run_sync():
+        es.ensure_indices()
+        with Pipeline() as pipeline:
+            poll(pipeline)
+    return run_sync
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['backfill', 'incremental', 'reindex'], required=True)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    run = get_runner(args.mode, args.workers)
+    started_at = perf_counter()
+    run()
+    seconds = perf_counter() - started_at
+    rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': rss_kb / 1024, 'stages': stage_timings()}))
+
+
+if __name__ == '__main__':
+    main()
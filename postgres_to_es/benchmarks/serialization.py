@@ -0,0 +1,101 @@
+"""
+Микробенчмарк сериализации документов для bulk-запроса.
+
+Сравнивает прежний путь (обычный dataclass -> dataclasses.asdict -> json.dumps, как это делал
+JSONSerializer клиента elasticSearch) с Document.to_json() у документов со __slots__.
+Дополнительно измеряет память, которую занимает пачка документов.
+
+Запуск из каталога postgres_to_es:
+
+    python -m benchmarks.serialization --docs 500 --repeat 20
+"""
+import argparse
+import json
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import date
+from timeit import timeit
+from typing import List
+
+from utils.dataclasses_etl import FilmWork, FilmWorkGenre, FilmWorkPerson, orjson
+
+
+@dataclass
+class PlainPerson:
+    id: uuid.UUID
+    name: str
+
+
+@dataclass
+class PlainFilmWork:
+    id: uuid.UUID
+    rating: float
+    type: str
+    title: str
+    description: str
+    genres_names: List[str]
+    directors_names: List[str]
+    actors_names: List[str]
+    writers_names: List[str]
+    genres: List[PlainPerson]
+    directors: List[PlainPerson]
+    actors: List[PlainPerson]
+    writers: List[PlainPerson]
+
+
+def es_default(obj):
+    """Обработка нестандартных типов, аналогичная JSONSerializer клиента elasticSearch."""
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError
+
+
+def make_docs(count: int, film_cls, person_cls, genre_cls) -> list:
+    docs = []
+    for i in range(count):
+        actors = [person_cls(uuid.uuid4(), f"Actor {i}-{j}") for j in range(10)]
+        directors = [person_cls(uuid.uuid4(), f"Director {i}")]
+        writers = [person_cls(uuid.uuid4(), f"Writer {i}-{j}") for j in range(3)]
+        genres = [genre_cls(uuid.uuid4(), f"Genre {j}") for j in range(3)]
+        docs.append(film_cls(
+            uuid.uuid4(), 7.5, 'movie', f"Film {i}", "Description " * 20,
+            [genre.name for genre in genres], [person.name for person in directors],
+            [person.name for person in actors], [person.name for person in writers],
+            genres, directors, actors, writers))
+    return docs
+
+
+def measure_memory(count: int, film_cls, person_cls, genre_cls) -> int:
+    tracemalloc.start()
+    docs = make_docs(count, film_cls, person_cls, genre_cls)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del docs
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=500, help="документов в пачке")
+    parser.add_argument('--repeat', type=int, default=20, help="повторов сериализации пачки")
+    args = parser.parse_args()
+
+    plain = make_docs(args.docs, PlainFilmWork, PlainPerson, PlainPerson)
+    slotted = make_docs(args.docs, FilmWork, FilmWorkPerson, FilmWorkGenre)
+
+    baseline = timeit(lambda: [json.dumps(asdict(doc), default=es_default) for doc in plain], number=args.repeat)
+    current = timeit(lambda: [doc.to_json() for doc in slotted], number=args.repeat)
+    total = args.docs * args.repeat
+
+    print(f"serializer: {'orjson' if orjson is not None else 'json (orjson is not installed)'}")
+    print(f"asdict + json.dumps: {total / baseline:>12.0f} docs/s")
+    print(f"Document.to_json:    {total / current:>12.0f} docs/s  (x{baseline / current:.1f})")
+    print(f"memory, plain:   {measure_memory(args.docs, PlainFilmWork, PlainPerson, PlainPerson) / 1024:>10.0f} KiB")
+    print(f"memory, slotted: {measure_memory(args.docs, FilmWork, FilmWorkPerson, FilmWorkGenre) / 1024:>10.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
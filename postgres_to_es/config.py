@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from typing import Literal, Optional
+
+from pydantic import BaseModel, root_validator
 from environ import environ
-from state import JsonFileStorage
+from state import BaseStorage, JsonFileStorage, SQLiteStorage, RedisStorage
 
 env = environ.Env()
 env.read_env()
@@ -15,6 +17,10 @@ class PostgresSettings(BaseModel):
     dsn: PostgresDsnSettings
     fetch_delay: float
     limit: int
+    pool_min_size: int = 1
+    pool_max_size: int = 5
+    pool_health_check_interval: float = 30
+    itersize: int = 1000
 
 
 class ElasticDsnSettings(BaseModel):
@@ -24,12 +30,75 @@ class ElasticDsnSettings(BaseModel):
 
 class ElasticSettings(BaseModel):
     dsn: ElasticDsnSettings
+    maxsize: int = 10
+    bulk_chunk_size: int = 500
+    bulk_max_chunk_bytes: int = 10 * 1024 * 1024
+    bulk_thread_count: int = 1
+    bulk_max_retries: int = 3
+    bulk_retry_backoff: float = 0.5
+    backfill_rows: int = 10000
+
+
+class AccumulatorSettings(BaseModel):
+    batch_size: int = 500
+    flush_interval: float = 5
+
+
+class AsyncRunnerSettings(BaseModel):
+    queue_size: int = 10
+
+
+class StateStorageSettings(BaseModel):
+    backend: Literal['json', 'sqlite', 'redis'] = 'json'
+    path: Optional[str] = None
+    url: str = 'local://'
+    key: str = 'etl_state'
+    checkpoint_pages: int = 10
+
+
+class ChangeFeedSettings(BaseModel):
+    enabled: bool = False
+    channel: str = 'content_changes'
+    fallback_interval: float = 60
+
+
+class DocumentHashSettings(BaseModel):
+    enabled: bool = False
+    path: str = './document_hashes.sqlite'
+
+
+class ApiCacheSettings(BaseModel):
+    enabled: bool = False
+    url: str = 'redis://movies-cache:6379/1'
+    key_prefix: str = ''
+    version: int = 1
+
+
+class MetricsSettings(BaseModel):
+    enabled: bool = False
+    port: int = 8001
 
 
 class Config(BaseModel):
     film_work_pg: PostgresSettings
     film_work_es: ElasticSettings
     state_file_path: str
+    state_storage: StateStorageSettings = StateStorageSettings()
+    accumulator: AccumulatorSettings = AccumulatorSettings()
+    runner: Literal['sync', 'async'] = 'sync'
+    extract_mode: Literal['objects', 'raw', 'stored'] = 'objects'
+    async_runner: AsyncRunnerSettings = AsyncRunnerSettings()
+    change_feed: ChangeFeedSettings = ChangeFeedSettings()
+    document_hashes: DocumentHashSettings = DocumentHashSettings()
+    metrics: MetricsSettings = MetricsSettings()
+    api_cache: ApiCacheSettings = ApiCacheSettings()
+
+    @root_validator(skip_on_failure=True)
+    def check_runner(cls, values):
+        """Асинхронный runner не читает журнал изменений, поэтому не видит удалений и удаленных связей."""
+        if values['runner'] == 'async' and values['change_feed'].enabled:
+            raise ValueError("runner 'async' does not support change_feed, disable change_feed.enabled")
+        return values
 
 
 config = Config.parse_file("config.json")
@@ -43,8 +112,52 @@ POSTGRES_DSL = {"dbname": env.str('POSTGRES_DB'),
 LIMIT = config.film_work_pg.limit
 FETCH_DELAY = config.film_work_pg.fetch_delay
 
+POSTGRES_POOL_MIN_SIZE = config.film_work_pg.pool_min_size
+POSTGRES_POOL_MAX_SIZE = config.film_work_pg.pool_max_size
+POSTGRES_POOL_HEALTH_CHECK_INTERVAL = config.film_work_pg.pool_health_check_interval
+POSTGRES_ITERSIZE = config.film_work_pg.itersize
+
 ELASTICSEARCH_HOST = config.film_work_es.dsn.host
 ELASTICSEARCH_PORT = config.film_work_es.dsn.port
+ELASTICSEARCH_MAXSIZE = config.film_work_es.maxsize
+ELASTICSEARCH_BULK_CHUNK_SIZE = config.film_work_es.bulk_chunk_size
+ELASTICSEARCH_BULK_MAX_CHUNK_BYTES = config.film_work_es.bulk_max_chunk_bytes
+ELASTICSEARCH_BULK_THREAD_COUNT = config.film_work_es.bulk_thread_count
+ELASTICSEARCH_BULK_MAX_RETRIES = config.film_work_es.bulk_max_retries
+ELASTICSEARCH_BULK_RETRY_BACKOFF = config.film_work_es.bulk_retry_backoff
+BACKFILL_ROWS = config.film_work_es.backfill_rows
+
+ACCUMULATOR_BATCH_SIZE = config.accumulator.batch_size
+ACCUMULATOR_FLUSH_INTERVAL = config.accumulator.flush_interval
+
+ETL_RUNNER = config.runner
+ASYNC_QUEUE_SIZE = config.async_runner.queue_size
+EXTRACT_MODE = config.extract_mode
+
+CHANGE_FEED_ENABLED = config.change_feed.enabled
+CHANGE_FEED_CHANNEL = config.change_feed.channel
+CHANGE_FEED_FALLBACK_INTERVAL = config.change_feed.fallback_interval
+
+DOCUMENT_HASHES_PATH = config.document_hashes.path if config.document_hashes.enabled else None
+
+API_CACHE_URL = config.api_cache.url if config.api_cache.enabled else None
+API_CACHE_KEY_PREFIX = config.api_cache.key_prefix
+API_CACHE_VERSION = config.api_cache.version
+
+METRICS_ENABLED = config.metrics.enabled
+METRICS_PORT = config.metrics.port
 
 STATE_FILE_PATH = config.state_file_path
-STORAGE = JsonFileStorage(STATE_FILE_PATH)
+CHECKPOINT_PAGES = config.state_storage.checkpoint_pages
+
+
+def get_storage(settings: StateStorageSettings) -> BaseStorage:
+    """Функция создает хранилище состояния, выбранное в конфиге."""
+    if settings.backend == 'sqlite':
+        return SQLiteStorage(settings.path or './state_storage.sqlite')
+    if settings.backend == 'redis':
+        return RedisStorage(settings.url, settings.key)
+    return JsonFileStorage(settings.path or STATE_FILE_PATH)
+
+
+STORAGE = get_storage(config.state_storage)
@@ -0,0 +1,137 @@
+"""
+Полная параллельная переиндексация кинопроизведений.
+
+Пространство UUID делится на равные диапазоны, каждый диапазон обрабатывает отдельный
+процесс со своими соединениями с Postgres и elasticSearch. Используется при первом запуске
+и после изменения маппинга индекса:
+
+    python3 reindex.py --workers 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import uuid
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Callable, List, Tuple
+
+from config import LIMIT, EXTRACT_MODE, DOCUMENT_HASHES_PATH
+from utils.es_utils import ElasticSearchConnector
+from utils.hashes import DocumentHashes
+from utils.pg_utils import PostgresConnector
+from utils.queries import (FILM_IDS_RANGE_QUERY, FILMS_RANGE_COUNT_QUERY, FILMS_QUERY, RAW_DOCUMENT_QUERIES,
+                           STORED_DOCUMENT_QUERIES, NOW_QUERY, CHANGED_FILMS_SINCE_QUERY,
+                           STORED_CHANGED_FILMS_SINCE_QUERY)
+from utils.transform import to_film_work, to_raw_document
+
+UUID_SPACE = 2 ** 128
+# Запас для транзакций, которые начались (и получили updated_at) до начала переиндексации,
+# а закоммичены после.
+REPLAY_MARGIN = timedelta(minutes=1)
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+
+def get_partitions(count: int) -> List[Tuple[str, str]]:
+    """Функция делит пространство UUID на count непересекающихся диапазонов [lower, upper]."""
+    bounds = [UUID_SPACE * i // count for i in range(count + 1)]
+    return [(str(uuid.UUID(int=bounds[i])), str(uuid.UUID(int=bounds[i + 1] - 1))) for i in range(count)]
+
+
+def get_films_query() -> Tuple[str, Callable]:
+    """Функция возвращает запрос документов кинопроизведений по id и их преобразование для extract_mode."""
+    if EXTRACT_MODE == 'raw':
+        return RAW_DOCUMENT_QUERIES['film_work'], to_raw_document
+    if EXTRACT_MODE == 'stored':
+        return STORED_DOCUMENT_QUERIES['film_work'], to_raw_document
+    return FILMS_QUERY, to_film_work
+
+
+def reindex_partition(partition: int, lower: str, upper: str, index: str) -> int:
+    """
+    Функция переиндексирует кинопроизведения с id в диапазоне [lower, upper] в индекс index.
+    Диапазон читается по курсору id, прогресс пишется в лог после каждой страницы.
+
+    :return: количество загруженных кинопроизведений
+    """
+    pg = PostgresConnector()
+    es = ElasticSearchConnector()
+    films_query, transform = get_films_query()
+    total = pg.query(FILMS_RANGE_COUNT_QUERY, (lower, upper))[0][0]
+    logging.info(f"partition {partition}: {total} films in [{lower}, {upper}]")
+    done = 0
+    started_at = monotonic()
+    while True:
+        film_ids = [row[0] for row in pg.query(FILM_IDS_RANGE_QUERY, (lower, upper, LIMIT))]
+        if not film_ids:
+            break
+        films = [transform(film) for film in pg.query(films_query, (film_ids,))]
+        es.bulk_update(films, 'film_work', index)
+        done += len(film_ids)
+        logging.info(f"partition {partition}: {done}/{total} films, "
+                     f"{done / max(monotonic() - started_at, 1e-9):.0f} films/sec")
+        last_id = uuid.UUID(film_ids[-1]).int
+        if last_id + 1 >= UUID_SPACE:
+            break
+        lower = str(uuid.UUID(int=last_id + 1))
+    return done
+
+
+def replay_changes(pg: PostgresConnector, es: ElasticSearchConnector, since: datetime) -> int:
+    """
+    Функция повторно загружает через алиас кинопроизведения, измененные с момента since.
+    Пока шла переиндексация, инкрементальный ETL писал эти изменения в старый индекс,
+    и после переключения алиаса они пропали бы.
+
+    :return: количество загруженных кинопроизведений
+    """
+    if EXTRACT_MODE == 'stored':
+        changed_ids = [row[0] for row in pg.query(STORED_CHANGED_FILMS_SINCE_QUERY, (since,))]
+    else:
+        changed_ids = [row[0] for row in pg.query(CHANGED_FILMS_SINCE_QUERY, (since,) * 5)]
+    films_query, transform = get_films_query()
+    for i in range(0, len(changed_ids), LIMIT):
+        films = [transform(film) for film in pg.query(films_query, (changed_ids[i:i + LIMIT],))]
+        es.bulk_update(films, 'film_work')
+    return len(changed_ids)
+
+
+def init_worker():
+    logging.basicConfig(level=logging.INFO, format=f'[pid %(process)d] {LOG_FORMAT}')
+
+
+def reindex(workers: int, keep_old: bool = False) -> int:
+    """
+    Функция запускает переиндексацию всех диапазонов в пуле из workers процессов.
+    Данные пишутся в новый индекс, настроенный на массовую загрузку; поиск в это время
+    продолжает обслуживать старый индекс. После загрузки алиас film атомарно
+    переключается на новый индекс, и в него повторно загружаются кинопроизведения, измененные
+    с начала переиндексации (с запасом REPLAY_MARGIN). Переиндексация пишет все документы
+    без сверки хешей содержимого, а хеши старого индекса после переключения сбрасываются.
+    """
+    partitions = get_partitions(workers)
+    pg = PostgresConnector()
+    es = ElasticSearchConnector()
+    since = pg.query(NOW_QUERY, ())[0][0] - REPLAY_MARGIN
+    index = es.start_bulk_load('film_work')
+    logging.info(f"reindex films into '{index}'")
+    started_at = monotonic()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=init_worker) as pool:
+        loaded = sum(pool.starmap(reindex_partition,
+                                  [(i, lower, upper, index) for i, (lower, upper) in enumerate(partitions)]))
+    es.finish_bulk_load('film_work', index, keep_old=keep_old)
+    replayed = replay_changes(pg, es, since)
+    logging.info(f"replayed {replayed} films changed during reindex")
+    DocumentHashes(DOCUMENT_HASHES_PATH).clear('film_work')
+    logging.info(f"reindexed {loaded} films in {monotonic() - started_at:.1f}s with {workers} workers")
+    return loaded
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    parser = argparse.ArgumentParser(description='Full parallel reindex of film_work into elasticSearch.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--keep-old', action='store_true', help='keep the previous index after the alias switch')
+    args = parser.parse_args()
+    reindex(args.workers, args.keep_old)
@@ -1,10 +1,18 @@
 import abc
 import json
 import logging
-from typing import Optional, Any
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from typing import Optional, Any, Dict
 
 
 class BaseStorage(abc.ABC):
+    # Хранилище пишет переданные ключи по одному, не затирая остальные: ему можно передавать
+    # только изменившиеся ключи. Иначе save_state каждый раз получает состояние целиком.
+    key_value = False
+
     @abc.abstractmethod
     def save_state(self, state: dict) -> None:
         """Сохранить состояние в постоянное хранилище."""
@@ -21,11 +29,26 @@ class JsonFileStorage(BaseStorage):
         self.file_path = file_path
 
     def save_state(self, state: dict) -> None:
+        """
+        Состояние пишется во временный файл рядом с основным, сбрасывается на диск
+        и атомарно подменяет основной файл, поэтому падение во время записи
+        не оставляет поврежденный файл состояния.
+        """
         if self.file_path is None:
             return
 
-        with open(self.file_path, 'w') as f:
-            json.dump(state, f)
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.state_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def retrieve_state(self) -> dict:
         if self.file_path is None:
@@ -40,6 +63,74 @@ class JsonFileStorage(BaseStorage):
 
         except FileNotFoundError:
             self.save_state({})
+            return {}
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояния в файле SQLite: каждая запись состояния - одна транзакция."""
+    key_value = True
+
+    def __init__(self, db_path: str, table: str = 'etl_state'):
+        self.db_path = db_path
+        self.table = table
+        with self.connect() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def save_state(self, state: dict) -> None:
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                                   [(key, json.dumps(value)) for key, value in state.items()])
+
+    def retrieve_state(self) -> dict:
+        with closing(self.connect()) as connection:
+            rows = connection.execute(f"SELECT key, value FROM {self.table}").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+
+class LocalRedis:
+    """
+    Локальная замена сервера Redis для разработки и тестов: поддерживает только
+    команды хешей, которые использует RedisStorage.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Dict[str, str]] = {}
+
+    def hset(self, name: str, mapping: Dict[str, str]) -> int:
+        self.data.setdefault(name, {}).update(mapping)
+        return len(mapping)
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self.data.get(name, {}))
+
+
+class RedisStorage(BaseStorage):
+    """
+    Хранилище состояния в хеше Redis, общее для нескольких экземпляров ETL.
+    Без адреса сервера (url='local://') используется LocalRedis внутри процесса.
+    """
+    key_value = True
+
+    def __init__(self, url: str, key: str = 'etl_state'):
+        self.key = key
+        if url.startswith('local://'):
+            self.client = LocalRedis()
+        else:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("RedisStorage requires the 'redis' package: pip install redis")
+            self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def save_state(self, state: dict) -> None:
+        if state:
+            self.client.hset(self.key, mapping={key: json.dumps(value) for key, value in state.items()})
+
+    def retrieve_state(self) -> dict:
+        return {key: json.loads(value) for key, value in self.client.hgetall(self.key).items()}
 
 
 class State:
@@ -57,9 +148,19 @@ class State:
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа."""
-        self.state[key] = value
+        self.update_state({key: value})
+
+    def update_state(self, values: dict) -> None:
+        """
+        Установить состояние сразу для нескольких ключей одной записью в хранилище.
+
+        В хранилища ключ-значение пишутся только ключи values: состояние в памяти загружено
+        при старте, и запись его целиком вернула бы назад ключи, которые с тех пор сохранили
+        другие экземпляры ETL.
+        """
+        self.state.update(values)
 
-        self.storage.save_state(self.state)
+        self.storage.save_state(values if self.storage.key_value else self.state)
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу."""
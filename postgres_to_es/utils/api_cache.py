@@ -0,0 +1,58 @@
+import logging
+import time
+from typing import Iterable, Optional
+
+# Ключи кэша API фильмов из movies_admin/api/v1/cache.py.
+LIST_GENERATION_KEY = 'api:v1:movies:list:generation'
+MOVIE_DETAIL_KEY = 'api:v1:movies:detail:{id}'
+
+
+class ApiCache:
+    """
+    Сброс кэша ответов API фильмов после того, как elasticSearch подтвердил загрузку документов.
+
+    Сигналы Django не видят изменений в обход ORM (QuerySet.update(), load_data.py, SQL), а при
+    MOVIES_API_BACKEND=elasticsearch срабатывают раньше, чем ETL загрузит изменение в индекс.
+    ETL видит все изменения, поэтому удаляет карточки загруженных фильмов и сдвигает поколение
+    кэша списков. Работает с общим кэшем API в Redis (CACHE_URL=rediscache://... и django-redis),
+    ключи строятся как KEY_FUNCTION Django по умолчанию: '<KEY_PREFIX>:<VERSION>:<ключ>'.
+    Без адреса (url=None) кэш не сбрасывается.
+    """
+
+    def __init__(self, url: Optional[str] = None, key_prefix: str = '', version: int = 1):
+        self.key_prefix = key_prefix
+        self.version = version
+        self.client = None
+        if url is None:
+            return
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("ApiCache requires the 'redis' package: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.errors = (redis.RedisError,)
+
+    def make_key(self, key: str) -> str:
+        return f'{self.key_prefix}:{self.version}:{key}'
+
+    def invalidate(self, film_ids: Iterable[str]) -> None:
+        """
+        Функция удаляет из кэша карточки фильмов film_ids и все страницы списка. Если ключа
+        поколения нет, он создается из времени, как в get_list_generation API, чтобы новое
+        поколение не совпало со старым.
+
+        Ошибка Redis не останавливает ETL: документы уже в индексе, а устаревший ответ
+        живет в кэше не дольше API_CACHE_TIMEOUT.
+        """
+        keys = [self.make_key(MOVIE_DETAIL_KEY.format(id=film_id)) for film_id in film_ids]
+        if self.client is None or not keys:
+            return
+        generation_key = self.make_key(LIST_GENERATION_KEY)
+        try:
+            with self.client.pipeline() as pipeline:
+                pipeline.delete(*keys)
+                pipeline.set(generation_key, int(time.time() * 1000), nx=True)
+                pipeline.incr(generation_key)
+                pipeline.execute()
+        except self.errors as e:
+            logging.warning(f"failed to invalidate movies API cache: {e}")
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import re
+from typing import Iterable, List, Optional, Set
+
+import asyncpg
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+from config import (POSTGRES_DSL, POSTGRES_POOL_MIN_SIZE, POSTGRES_POOL_MAX_SIZE, ELASTICSEARCH_HOST,
+                    ELASTICSEARCH_PORT, ELASTICSEARCH_MAXSIZE, ELASTICSEARCH_BULK_CHUNK_SIZE,
+                    ELASTICSEARCH_BULK_MAX_CHUNK_BYTES, ELASTICSEARCH_BULK_MAX_RETRIES, ELASTICSEARCH_BULK_RETRY_BACKOFF)
+from utils.dataclasses_etl import Document
+from utils.decorators import async_backoff
+from utils.es_utils import BulkRetryError, ElasticSearchConnector, INDEX_SETTINGS
+from utils.hashes import DocumentHashes
+from utils.metrics import count_bulk_errors
+
+
+def to_asyncpg(sql: str) -> str:
+    """Функция переводит параметры запроса из стиля psycopg2 (%s) в стиль asyncpg ($1, $2, ...)."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', sql)
+
+
+async def init_connection(conn: asyncpg.Connection):
+    """Функция включает разбор json/jsonb в словари, как это делает psycopg2."""
+    for pg_type in ('json', 'jsonb'):
+        await conn.set_type_codec(pg_type, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+class AsyncPostgresConnector:
+    """Асинхронный аналог PostgresConnector поверх пула соединений asyncpg."""
+
+    def __init__(self):
+        self.pool: Optional[asyncpg.Pool] = None
+
+    @async_backoff()
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(database=POSTGRES_DSL['dbname'],
+                                              user=POSTGRES_DSL['user'],
+                                              password=POSTGRES_DSL['password'],
+                                              host=POSTGRES_DSL['host'],
+                                              port=POSTGRES_DSL['port'],
+                                              min_size=POSTGRES_POOL_MIN_SIZE,
+                                              max_size=POSTGRES_POOL_MAX_SIZE,
+                                              init=init_connection)
+
+    @async_backoff()
+    async def query(self, sql: str, args: tuple) -> list:
+        """Функция для декорированного запроса к БД; принимает те же запросы, что и PostgresConnector."""
+        async with self.pool.acquire() as connection:
+            return await connection.fetch(to_asyncpg(sql), *args)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+
+class AsyncElasticSearchConnector:
+    """Асинхронный аналог ElasticSearchConnector с тем же разбором ответа bulk-запроса."""
+    index_map = ElasticSearchConnector.index_map
+
+    def __init__(self, hashes: Optional[DocumentHashes] = None):
+        self.es = AsyncElasticsearch(hosts=[{"host": ELASTICSEARCH_HOST, "port": ELASTICSEARCH_PORT}],
+                                     maxsize=ELASTICSEARCH_MAXSIZE)
+        self.hashes = hashes
+        self.known_indices: Set[str] = set()
+        self.index_lock = asyncio.Lock()
+
+    @async_backoff()
+    async def ensure_index(self, table: str):
+        """Функция проверяет наличие индекса один раз и создает его при необходимости."""
+        alias, mappings = self.index_map[table]
+        async with self.index_lock:
+            if alias in self.known_indices:
+                return
+            if not await self.es.indices.exists(index=alias):
+                await self.es.indices.create(index=ElasticSearchConnector.get_versioned_name(alias),
+                                             mappings=mappings, settings=INDEX_SETTINGS, aliases={alias: {}})
+                if self.hashes is not None:
+                    self.hashes.clear(table)
+            else:
+                await self.es.indices.put_mapping(index=alias, body=mappings)
+            self.known_indices.add(alias)
+
+    async def get_actions(self, docs: Iterable[Document], table: str):
+        index = self.index_map[table][0]
+        for doc in docs:
+            yield {'_index': index, '_id': str(doc.id), '_source': doc.to_json()}
+
+    @async_backoff()
+    async def bulk_update(self, docs: List[Document], table: str) -> Set[str]:
+        """
+        Функция загружает документы в индекс elasticSearch, повторяя только документы,
+        отклоненные с 429/5xx или из-за отсутствия индекса. Если они не загрузились
+        и после всех повторов, выбрасывается BulkRetryError, как в ElasticSearchConnector.send_bulk.
+
+        :return: id документов, окончательно отклоненных elasticSearch
+        """
+        await self.ensure_index(table)
+        failed_ids: Set[str] = set()
+        pending = docs
+        for attempt in range(ELASTICSEARCH_BULK_MAX_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                await asyncio.sleep(ELASTICSEARCH_BULK_RETRY_BACKOFF * 2 ** (attempt - 1))
+            results = [result async for result in async_streaming_bulk(
+                self.es, self.get_actions(pending, table),
+                chunk_size=ELASTICSEARCH_BULK_CHUNK_SIZE,
+                max_chunk_bytes=ELASTICSEARCH_BULK_MAX_CHUNK_BYTES,
+                raise_on_error=False)]
+            retry_ids, rejected_ids, index_missing = ElasticSearchConnector.sort_bulk_errors(results)
+            count_bulk_errors(table, retry_ids, rejected_ids)
+            failed_ids.update(rejected_ids)
+            if index_missing:
+                self.known_indices.discard(self.index_map[table][0])
+                await self.ensure_index(table)
+            pending = [doc for doc in pending if str(doc.id) in retry_ids]
+        if pending:
+            raise BulkRetryError(f"failed to load {len(pending)} documents in '{table}' index after retries")
+        return failed_ids
+
+    async def close(self):
+        await self.es.close()
@@ -0,0 +1,53 @@
+import logging
+import select
+
+import psycopg2
+from psycopg2.extensions import connection as _connection
+
+from config import POSTGRES_DSL, CHANGE_FEED_CHANNEL
+from utils.decorators import backoff
+
+
+class ChangeFeed:
+    """
+    Подписка на уведомления об изменениях контента (LISTEN/NOTIFY).
+
+    Уведомления только будят ETL: сами изменения берутся из журнала content.change_log,
+    поэтому потерянное уведомление ничего не ломает - журнал будет вычитан при следующем
+    пробуждении. Для подписки используется отдельное соединение вне пула, так как оно
+    все время ждет уведомлений.
+    """
+
+    def __init__(self, channel: str = CHANGE_FEED_CHANNEL):
+        self.channel = channel
+        self.connection = self.listen()
+
+    @backoff()
+    def listen(self) -> _connection:
+        connection = psycopg2.connect(**POSTGRES_DSL)
+        connection.set_session(autocommit=True)
+        with connection.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel};")
+        return connection
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Функция ждет уведомления не дольше timeout секунд.
+
+        :return: True, если пришло уведомление или соединение было восстановлено
+            (тогда журнал стоит вычитать), False по таймауту
+        """
+        try:
+            if not self.connection.notifies:
+                if not select.select([self.connection], [], [], timeout)[0]:
+                    return False
+                self.connection.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logging.exception(e)
+            self.connection = self.listen()
+            return True
+        self.connection.notifies.clear()
+        return True
+
+    def close(self):
+        self.connection.close()
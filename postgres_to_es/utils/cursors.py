@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+from typing import Callable, Dict, Tuple
+
+from config import STORAGE, BACKFILL_ROWS
+from state import State
+
+state = State(STORAGE)
+
+START_CRAWL_TIME = datetime(1900, 1, 1, 0, 0, 0, 0, tzinfo=timezone.utc)
+START_CRAWL_ID = '00000000-0000-0000-0000-000000000000'
+
+
+def get_cursor(table: str) -> Tuple[datetime, str]:
+    """
+    Функция возвращает сохраненный в состоянии курсор (updated_at, id) для таблицы.
+    Если курсора еще нет, возвращается курсор, указывающий на начало таблицы.
+
+    :param table: таблица в БД, для которой нужен курсор
+    """
+    last_crawl_time = state.get_state(f"last_{table}_crawl_time")
+    last_crawl_id = state.get_state(f"last_{table}_crawl_id") or START_CRAWL_ID
+    if not last_crawl_time:
+        return START_CRAWL_TIME, START_CRAWL_ID
+    return parse_crawl_time(last_crawl_time), last_crawl_id
+
+
+def parse_crawl_time(value: str) -> datetime:
+    """
+    Функция читает время курсора из состояния. Время хранится в UTC со смещением, поэтому
+    курсор одинаково понимают psycopg2 (синхронный runner) и asyncpg (асинхронный), какой бы
+    ни была настройка TimeZone сервера. Время без смещения из прежних версий считается UTC.
+    """
+    crawl_time = datetime.fromisoformat(value)
+    if crawl_time.tzinfo is None:
+        crawl_time = crawl_time.replace(tzinfo=timezone.utc)
+    return crawl_time
+
+
+def dump_cursor(table: str, last_crawl_time: datetime, last_crawl_id: str) -> Dict[str, str]:
+    """Функция превращает курсор (updated_at, id) таблицы в ключи состояния."""
+    return {f"last_{table}_crawl_time": last_crawl_time.astimezone(timezone.utc).isoformat(),
+            f"last_{table}_crawl_id": str(last_crawl_id)}
+
+
+class Checkpoint:
+    """
+    Курсоры, которые сохраняются в состоянии только после того, как elasticSearch
+    подтвердил загрузку всех прочитанных до них данных.
+
+    stage() запоминает курсор в памяти, commit() записывает все накопленные курсоры
+    в хранилище одной записью. Вызывающий код делает commit() только после сброса
+    буферов pipeline, поэтому после падения чтение продолжается с последнего курсора,
+    данные до которого гарантированно есть в индексе.
+    """
+
+    def __init__(self, state: State):
+        self.state = state
+        self.pending: Dict[str, str] = {}
+
+    def stage(self, table: str, last_crawl_time: datetime, last_crawl_id: str) -> None:
+        self.pending.update(dump_cursor(table, last_crawl_time, last_crawl_id))
+
+    def commit(self) -> None:
+        if self.pending:
+            self.state.update_state(self.pending)
+            self.pending = {}
+
+
+checkpoint = Checkpoint(state)
+
+
+def is_backfill(last_crawl_time: datetime, count_pending: Callable[[int], int]) -> bool:
+    """
+    Функция определяет, что ETL догружает большой объем данных: состояние пустое или после
+    курсора накопилось не меньше BACKFILL_ROWS измененных строк. Время с последнего изменения
+    не учитывается: первое изменение после долгого затишья - это не догрузка.
+
+    :param last_crawl_time: время из курсора таблицы
+    :param count_pending: функция, которая считает строки после курсора, но не больше переданного предела
+    """
+    return last_crawl_time == START_CRAWL_TIME or count_pending(BACKFILL_ROWS) >= BACKFILL_ROWS
@@ -1,29 +1,77 @@
+import json
 import uuid
 from dataclasses import dataclass
 from datetime import datetime, date
 
-from typing import List
+from typing import Any, List
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
-class FilmWorkPerson:
+
+def _default(obj: Any) -> Any:
+    """Функция приводит к JSON типы, которые не умеет сериализовать стандартный json."""
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Document):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data: Any) -> str:
+    """
+    Функция сериализует данные в JSON. orjson сам обходит dataclass-ы со __slots__,
+    UUID и даты без промежуточных словарей; без orjson используется стандартный json.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default).decode()
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+class Document:
+    """
+    Базовый класс документов elasticSearch. Документы неизменяемые и хранят поля в __slots__,
+    поэтому у вложенных объектов нет собственного __dict__.
+    """
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        """Функция возвращает поверхностную копию документа в виде словаря (в отличие от asdict без deepcopy)."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def to_json(self) -> str:
+        """Функция сериализует документ в JSON для _source bulk-запроса."""
+        return dumps(self)
+
+
+@dataclass(frozen=True)
+class FilmWorkPerson(Document):
+    __slots__ = ('id', 'name')
     id: uuid.UUID
     name: str
 
 
-@dataclass
-class FilmWorkGenre:
+@dataclass(frozen=True)
+class FilmWorkGenre(Document):
+    __slots__ = ('id', 'name')
     id: uuid.UUID
     name: str
 
 
-@dataclass
-class FilmWork:
+@dataclass(frozen=True)
+class FilmWork(Document):
+    __slots__ = ('id', 'rating', 'type', 'title', 'description', 'creation_date', 'genres_names',
+                 'directors_names', 'actors_names', 'writers_names', 'genres', 'directors', 'actors', 'writers')
     id: uuid.UUID
     rating: float
     type: str
     title: str
     description: str
+    creation_date: date
     genres_names: List[str]
     directors_names: List[str]
     actors_names: List[str]
@@ -34,18 +82,36 @@ class FilmWork:
     writers: List[FilmWorkPerson]
 
 
-@dataclass
-class Genre:
+@dataclass(frozen=True)
+class Genre(Document):
+    __slots__ = ('id', 'name', 'description')
     id: uuid.UUID
     name: str
     description: str
 
 
-@dataclass
-class Person:
+@dataclass(frozen=True)
+class Person(Document):
+    __slots__ = ('id', 'full_name', 'roles', 'birth_date', 'film_ids')
     id: uuid.UUID
     full_name: str
     roles: List[str]
     birth_date: date
     film_ids: List[uuid.UUID]
 
+
+@dataclass(frozen=True)
+class RawDocument(Document):
+    """
+    Документ, собранный в БД: source - готовый JSON-текст, который без разбора
+    копируется в тело bulk-запроса.
+    """
+    __slots__ = ('id', 'source')
+    id: uuid.UUID
+    source: str
+
+    def to_dict(self) -> dict:
+        return json.loads(self.source)
+
+    def to_json(self) -> str:
+        return self.source
@@ -1,9 +1,10 @@
+import asyncio
 import logging
 from functools import wraps
 from time import sleep
 
 
-def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
+def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10, exceptions=(Exception,)):
     """
     Функция для повторного выполнения функции через некоторое время, если возникла ошибка.
     Использует наивный экспоненциальный рост времени повтора (factor) до граничного времени
@@ -15,6 +16,7 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
     :param start_sleep_time: начальное время повтора
     :param factor: во сколько раз нужно увеличить время ожидания
     :param border_sleep_time: граничное время ожидания
+    :param exceptions: ошибки, после которых функция повторяется, остальные пробрасываются
     :return: результат выполнения функции
     """
 
@@ -27,7 +29,7 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
                 try:
                     attempt += 1
                     return func(*args, **kwargs)
-                except Exception as e:
+                except exceptions as e:
                     logging.exception(e)
                     sleep_time = start_sleep_time * factor**attempt if sleep_time < border_sleep_time else sleep_time
                     sleep(sleep_time)
@@ -35,6 +37,29 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
     return func_wrapper
 
 
+def async_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
+    """
+    Аналог backoff для асинхронных функций: ожидание между повторами не блокирует
+    цикл событий, поэтому остальные задачи продолжают работать.
+    """
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            attempt = 0
+            sleep_time = start_sleep_time
+            while True:
+                try:
+                    attempt += 1
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    logging.exception(e)
+                    sleep_time = start_sleep_time * factor**attempt if sleep_time < border_sleep_time else sleep_time
+                    await asyncio.sleep(sleep_time)
+        return inner
+    return func_wrapper
+
+
 def coroutine(f):
     """Декоратор для инициализации корутины."""
     def wrapper(*args, **kwargs):
@@ -1,16 +1,32 @@
-from dataclasses import asdict
-from typing import List
+import logging
+from datetime import datetime
+from time import sleep
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from elasticsearch import Elasticsearch
+from elasticsearch import ConnectionError as ESConnectionError, Elasticsearch, NotFoundError, helpers
 
 from utils.decorators import backoff
 
-from config import ELASTICSEARCH_HOST, ELASTICSEARCH_PORT
-from utils.dataclasses_etl import FilmWork
+from config import (ELASTICSEARCH_HOST, ELASTICSEARCH_PORT, ELASTICSEARCH_MAXSIZE, ELASTICSEARCH_BULK_CHUNK_SIZE,
+                    ELASTICSEARCH_BULK_MAX_CHUNK_BYTES, ELASTICSEARCH_BULK_THREAD_COUNT, ELASTICSEARCH_BULK_MAX_RETRIES,
+                    ELASTICSEARCH_BULK_RETRY_BACKOFF)
+from utils.dataclasses_etl import Document
+from utils.hashes import DocumentHashes
+from utils.metrics import count_bulk_errors
 from utils.film_es_index import INDEX_FILM_MAPPINGS, INDEX_FILM_NAME
 from utils.genre_es_index import INDEX_GENRE_NAME, INDEX_GENRE_MAPPINGS
 from utils.person_es_index import INDEX_PERSON_NAME, INDEX_PERSON_MAPPINGS
 
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+ES_CONNECTION_ERRORS = (ESConnectionError,)
+
+
+class BulkRetryError(Exception):
+    """
+    Документы, отклоненные из-за временной ошибки elasticSearch, не загрузились и после всех повторов.
+    Исключение не дает сохранить курсор, и пачка целиком повторяется через backoff.
+    """
+
 INDEX_SETTINGS = {
     "index": {
         "number_of_shards": 1,
@@ -39,43 +55,347 @@ INDEX_SETTINGS = {
                 "type": "stemmer",
                 "language": "russian"
             }
+        },
+        "analyzer": {
+            "ru_en": {
+                "tokenizer": "standard",
+                "filter": [
+                    "lowercase",
+                    "english_stop",
+                    "english_stemmer",
+                    "english_possessive_stemmer",
+                    "russian_stop",
+                    "russian_stemmer"
+                ]
+            }
         }
     }
 }
 
+BACKFILL_SETTINGS = {
+    "index": {
+        "refresh_interval": "-1",
+        "translog.durability": "async"
+    }
+}
+
+BULK_LOAD_SETTINGS = {
+    "index": {
+        **BACKFILL_SETTINGS["index"],
+        "number_of_replicas": 0
+    }
+}
+
+SERVING_SETTINGS = {
+    "index": {
+        "refresh_interval": INDEX_SETTINGS["refresh_interval"],
+        "translog.durability": "request",
+        "number_of_replicas": INDEX_SETTINGS["index"]["number_of_replicas"]
+    }
+}
+
 
 class ElasticSearchConnector:
+    """
+    Долгоживущий клиент elasticSearch.
+
+    Клиент держит пул keep-alive соединений (maxsize), поэтому его нужно создавать один раз
+    на процесс. Существование индексов проверяется один раз и запоминается в known_indices;
+    повторная проверка делается только если bulk-запрос ответил 404 на отсутствующий индекс.
+
+    Имена из index_map - это алиасы, через которые идут чтение и инкрементальная запись.
+    Физические индексы версионируются (film_20211001120000), поэтому полная переиндексация
+    пишет в новый индекс, а затем алиас атомарно переключается на него.
+
+    Когда индекс создается заново, хеши документов его таблицы (hashes) удаляются: иначе
+    неизмененные документы не попали бы в новый пустой индекс.
+    """
     index_map = {
         "film_work": (INDEX_FILM_NAME, INDEX_FILM_MAPPINGS),
         "genre": (INDEX_GENRE_NAME, INDEX_GENRE_MAPPINGS),
         "person": (INDEX_PERSON_NAME, INDEX_PERSON_MAPPINGS),
     }
 
-    def __init__(self):
+    def __init__(self, hashes: Optional[DocumentHashes] = None):
         self.es = self.connect()
+        self.hashes = hashes
+        self.known_indices: Set[str] = set()
+        # Настройки рабочих индексов до перевода в режим догрузки: {table: {index: {setting: value}}}.
+        self.backfill_restore: Dict[str, Dict[str, dict]] = {}
 
     @backoff()
     def connect(self) -> Elasticsearch:
-        return Elasticsearch(host=ELASTICSEARCH_HOST, port=ELASTICSEARCH_PORT)
+        return Elasticsearch(hosts=[{"host": ELASTICSEARCH_HOST, "port": ELASTICSEARCH_PORT}],
+                             maxsize=ELASTICSEARCH_MAXSIZE)
+
+    @staticmethod
+    def get_versioned_name(alias: str) -> str:
+        """Функция возвращает имя нового физического индекса для алиаса."""
+        return f"{alias}_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
 
     @backoff()
-    def create_index(self, index: str):
-        """Функция создает индекс для кинопроизведений в elasticSearch."""
-        self.es.indices.create(index=self.index_map[index][0],
-                               mappings=self.index_map[index][1],
-                               settings=INDEX_SETTINGS,
-                               ignore=400)
+    def create_index(self, table: str, settings: dict = INDEX_SETTINGS, with_alias: bool = True) -> str:
+        """
+        Функция создает новый версионированный индекс для таблицы в elasticSearch.
+
+        :param table: таблица в БД, для которой создается индекс
+        :param settings: настройки индекса
+        :param with_alias: сразу повесить на индекс алиас для чтения
+        :return: имя созданного физического индекса
+        """
+        alias, mappings = self.index_map[table]
+        index = self.get_versioned_name(alias)
+        aliases = {alias: {}} if with_alias else {}
+        self.es.indices.create(index=index, mappings=mappings, settings=settings, aliases=aliases)
+        return index
 
     @backoff()
-    def bulk_update(self, docs: List[FilmWork], table: str):
-        """Функция загружает пачками кинопроизведения в индекс elasticSearch."""
-        index_exists = self.es.indices.exists(index=self.index_map[table][0])
-        if not index_exists:
+    def ensure_index(self, table: str):
+        """
+        Функция проверяет наличие индекса (алиаса) один раз и создает его при необходимости.
+        В существующий индекс добавляются поля, появившиеся в маппинге: маппинг строгий,
+        и без них elasticSearch отклонил бы новые документы. Старые документы получают новые
+        поля при следующем изменении или после полной переиндексации.
+        """
+        alias, mappings = self.index_map[table]
+        if alias in self.known_indices:
+            return
+        if not self.es.indices.exists(index=alias):
             self.create_index(table)
-        if docs:
-            body = []
-            for doc in docs:
-                body.append({'index': {'_index': self.index_map[table][0],
-                                       '_id': doc.id}})
-                body.append(asdict(doc))
-            self.es.bulk(body=body)
+            if self.hashes is not None:
+                self.hashes.clear(table)
+        else:
+            self.es.indices.put_mapping(index=alias, body=mappings)
+        self.known_indices.add(alias)
+
+    @backoff()
+    def start_bulk_load(self, table: str) -> str:
+        """
+        Функция создает новый индекс для полной переиндексации. Индекс настроен на массовую
+        запись (без refresh и реплик) и не виден через алиас, пока не будет переключен.
+        """
+        settings = {**INDEX_SETTINGS, "index": {**INDEX_SETTINGS["index"], **BULK_LOAD_SETTINGS["index"]}}
+        settings.pop("refresh_interval")
+        return self.create_index(table, settings=settings, with_alias=False)
+
+    @backoff()
+    def finish_bulk_load(self, table: str, index: str, keep_old: bool = False):
+        """
+        Функция возвращает индексу обычные настройки и атомарно переключает на него алиас.
+        Старые индексы алиаса удаляются, если не указано keep_old.
+
+        :param table: таблица в БД, для которой переиндексировались данные
+        :param index: новый физический индекс
+        :param keep_old: оставить старые индексы после переключения
+        """
+        alias = self.index_map[table][0]
+        self.es.indices.put_settings(index=index, body=SERVING_SETTINGS)
+        self.es.indices.refresh(index=index)
+
+        actions = [{"add": {"index": index, "alias": alias}}]
+        old_indices = []
+        if self.es.indices.exists_alias(name=alias):
+            old_indices = [name for name in self.es.indices.get_alias(name=alias) if name != index]
+            actions = [{"remove": {"index": name, "alias": alias}} for name in old_indices] + actions
+        elif self.es.indices.exists(index=alias):
+            # Индекс без версии из старых запусков ETL: удаляется в той же операции, что и создается алиас.
+            actions = [{"remove_index": {"index": alias}}] + actions
+        self.es.indices.update_aliases(body={"actions": actions})
+        self.known_indices.add(alias)
+        logging.info(f"alias '{alias}' switched to index '{index}'")
+
+        if not keep_old:
+            for name in old_indices:
+                self.es.indices.delete(index=name, ignore=404)
+
+    def ensure_indices(self):
+        """Функция проверяет наличие всех индексов при старте ETL."""
+        for table in self.index_map:
+            self.ensure_index(table)
+
+    @backoff(exceptions=ES_CONNECTION_ERRORS)
+    def start_backfill(self, table: str):
+        """
+        Функция переводит рабочий индекс таблицы в режим массовой догрузки: без периодического
+        refresh и с асинхронным translog. Число реплик не меняется, индекс продолжает обслуживать поиск.
+
+        Прежние значения измененных настроек запоминаются, чтобы finish_backfill вернул именно их,
+        а не перезаписал настройки, заданные операторами. Значение режима догрузки, оставшееся
+        после аварийного завершения ETL, считается незаданным и сбрасывается к значению по умолчанию.
+
+        Повторяются только ошибки соединения. Если индекс за alias'ом удален переиндексацией
+        между чтением и изменением настроек, догрузка идет с обычными настройками.
+        """
+        self.ensure_index(table)
+        alias = self.index_map[table][0]
+        backfill = BACKFILL_SETTINGS["index"]
+        current = self.es.indices.get_settings(index=alias, name=[f"index.{name}" for name in backfill],
+                                               flat_settings=True)
+        restore = {}
+        for index, body in current.items():
+            settings = body.get("settings", {})
+            restore[index] = {name: None if settings.get(f"index.{name}") in (None, value)
+                              else settings[f"index.{name}"] for name, value in backfill.items()}
+        if not restore:
+            return
+        try:
+            self.es.indices.put_settings(index=list(restore), body=BACKFILL_SETTINGS)
+        except NotFoundError:
+            logging.warning(f"'{table}' index was replaced by reindex, backfill settings are not applied")
+            return
+        self.backfill_restore[table] = restore
+        logging.info(f"'{table}' index switched to backfill settings")
+
+    @backoff(exceptions=ES_CONNECTION_ERRORS)
+    def finish_backfill(self, table: str):
+        """
+        Функция возвращает рабочему индексу настройки, которые изменил start_backfill, и делает refresh.
+        Сегменты рабочего индекса не сливаются: forcemerge индекса, в который продолжается запись,
+        долгий и бесполезный.
+
+        Функция вызывается из finally, поэтому повторяются только ошибки соединения. Индекс,
+        удаленный переиндексацией за время догрузки, пропускается: его настройки восстанавливать
+        уже не нужно, а новый индекс создается с рабочими настройками.
+        """
+        alias = self.index_map[table][0]
+        restore = self.backfill_restore.get(table, {})
+        for index in list(restore):
+            try:
+                self.es.indices.put_settings(index=index, body={"index": restore[index]})
+            except NotFoundError:
+                logging.warning(f"'{index}' index no longer exists, its settings are not restored")
+            del restore[index]
+        self.backfill_restore.pop(table, None)
+        try:
+            self.es.indices.refresh(index=alias)
+        except NotFoundError:
+            logging.warning(f"'{alias}' alias not found, refresh skipped")
+        logging.info(f"'{table}' index switched back to serving settings")
+
+    def get_actions(self, docs: Iterable[Document], table: str, index: Optional[str] = None) -> Iterator[dict]:
+        """
+        Функция лениво превращает документы в действия index для bulk-запроса. _source передается
+        готовой JSON-строкой, которую клиент elasticSearch отправляет без повторной сериализации.
+        """
+        index = index or self.index_map[table][0]
+        for doc in docs:
+            yield {'_index': index, '_id': str(doc.id), '_source': doc.to_json()}
+
+    def stream_bulk(self, actions: Iterable[dict], count: int) -> Iterator[Tuple[bool, dict]]:
+        """
+        Функция отправляет действия в elasticSearch пачками, ограниченными по числу документов
+        и по размеру в байтах. При bulk_thread_count > 1 пачки отправляются параллельно, но только
+        если count действий не помещается в одну пачку: для одной пачки пул потоков не нужен.
+        """
+        if ELASTICSEARCH_BULK_THREAD_COUNT > 1 and count > ELASTICSEARCH_BULK_CHUNK_SIZE:
+            return helpers.parallel_bulk(self.es, actions,
+                                         thread_count=ELASTICSEARCH_BULK_THREAD_COUNT,
+                                         chunk_size=ELASTICSEARCH_BULK_CHUNK_SIZE,
+                                         max_chunk_bytes=ELASTICSEARCH_BULK_MAX_CHUNK_BYTES,
+                                         raise_on_error=False)
+        return helpers.streaming_bulk(self.es, actions,
+                                      chunk_size=ELASTICSEARCH_BULK_CHUNK_SIZE,
+                                      max_chunk_bytes=ELASTICSEARCH_BULK_MAX_CHUNK_BYTES,
+                                      raise_on_error=False)
+
+    def get_delete_actions(self, ids: Iterable[str], table: str, index: Optional[str] = None) -> Iterator[dict]:
+        """Функция лениво превращает id в действия delete для bulk-запроса."""
+        index = index or self.index_map[table][0]
+        for doc_id in ids:
+            yield {'_op_type': 'delete', '_index': index, '_id': doc_id}
+
+    @backoff()
+    def bulk_update(self, docs: List[Document], table: str, index: Optional[str] = None) -> Set[str]:
+        """
+        Функция загружает пачками кинопроизведения в индекс elasticSearch.
+
+        :param index: физический индекс для записи, по умолчанию алиас таблицы
+        :return: id документов, окончательно отклоненных elasticSearch
+        """
+        return self.send_bulk(docs, table, index, self.get_actions, lambda doc: str(doc.id))
+
+    @backoff()
+    def bulk_delete(self, ids: List[str], table: str, index: Optional[str] = None) -> Set[str]:
+        """
+        Функция удаляет пачками документы из индекса elasticSearch.
+        Документ, которого уже нет в индексе, считается удаленным.
+
+        :return: id документов, окончательно отклоненных elasticSearch
+        """
+        return self.send_bulk([str(doc_id) for doc_id in ids], table, index, self.get_delete_actions, str)
+
+    def send_bulk(self, items: list, table: str, index: Optional[str],
+                  to_actions: Callable[[Iterable, str, Optional[str]], Iterator[dict]],
+                  get_id: Callable[[Any], str]) -> Set[str]:
+        """
+        Функция отправляет действия для items в elasticSearch.
+
+        Ответ проверяется по каждому документу: повторно отправляются только документы,
+        отклоненные из-за перегрузки (429) или ошибки на стороне elasticSearch (5xx), либо
+        из-за отсутствия индекса - тогда индекс сначала создается заново. Если такие документы
+        остались и после ELASTICSEARCH_BULK_MAX_RETRIES повторов, выбрасывается BulkRetryError:
+        курсор и журнал изменений не должны сдвинуться дальше незагруженных документов.
+        Документы с остальными ошибками (4xx) окончательно отклонены, они пишутся в лог и пропускаются.
+
+        :param items: документы или id документов
+        :param to_actions: функция, которая превращает items в действия bulk-запроса
+        :param get_id: функция, которая возвращает id документа для элемента items
+        :return: id окончательно отклоненных документов
+        """
+        if index is None:
+            self.ensure_index(table)
+        failed_ids: Set[str] = set()
+        pending = items
+        for attempt in range(ELASTICSEARCH_BULK_MAX_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                sleep(ELASTICSEARCH_BULK_RETRY_BACKOFF * 2 ** (attempt - 1))
+            retry_ids, rejected_ids, index_missing = self.sort_bulk_errors(
+                self.stream_bulk(to_actions(pending, table, index), len(pending)))
+            count_bulk_errors(table, retry_ids, rejected_ids)
+            failed_ids.update(rejected_ids)
+            if index_missing and index is None:
+                self.known_indices.discard(self.index_map[table][0])
+                self.ensure_index(table)
+            pending = [item for item in pending if get_id(item) in retry_ids]
+            if pending:
+                logging.warning(f"retry {len(pending)} rejected documents in '{table}' index")
+        if pending:
+            raise BulkRetryError(f"failed to process {len(pending)} documents in '{table}' index after retries")
+        return failed_ids
+
+    @staticmethod
+    def is_index_missing(result: dict) -> bool:
+        """Функция проверяет, отклонил ли elasticSearch документ из-за отсутствия индекса."""
+        error = result.get('error')
+        return result.get('status') == 404 and isinstance(error, dict) \
+            and error.get('type') == 'index_not_found_exception'
+
+    @classmethod
+    def sort_bulk_errors(cls, results: Iterable[Tuple[bool, dict]]) -> Tuple[Set[str], Set[str], bool]:
+        """
+        Функция разбирает ответ bulk-запроса по документам.
+
+        :return: id документов для повтора, id окончательно отклоненных документов
+            и признак того, что индекс отсутствует
+        """
+        retry_ids: Set[str] = set()
+        rejected_ids: Set[str] = set()
+        index_missing = False
+        for ok, item in results:
+            if ok:
+                continue
+            op_type, result = next(iter(item.items()))
+            doc_id = str(result.get('_id'))
+            if op_type == 'delete' and result.get('status') == 404 and 'error' not in result:
+                continue
+            if cls.is_index_missing(result):
+                index_missing = True
+                retry_ids.add(doc_id)
+            elif result.get('status') in RETRYABLE_STATUSES:
+                retry_ids.add(doc_id)
+            else:
+                logging.error(f"elasticSearch rejected document '{doc_id}': {result.get('error')}")
+                rejected_ids.add(doc_id)
+        return retry_ids, rejected_ids, index_missing
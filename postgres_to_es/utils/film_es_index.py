@@ -25,6 +25,9 @@ INDEX_FILM_MAPPINGS = {
             "type": "text",
             "analyzer": "ru_en"
         },
+        "creation_date": {
+            "type": "date"
+        },
         "genres_names": {
             "type": "text",
             "analyzer": "ru_en"
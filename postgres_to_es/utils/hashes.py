@@ -0,0 +1,82 @@
+import hashlib
+import sqlite3
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.dataclasses_etl import Document
+
+# Ограничение SQLite на число параметров запроса в старых версиях - 999.
+SQLITE_MAX_VARIABLES = 900
+
+
+class DocumentHashes:
+    """
+    Хеши содержимого документов, последними загруженных в elasticSearch, в локальном файле SQLite.
+
+    Изменение updated_at без изменения данных (сохранение в админке без правок, пересборка
+    фильмов из-за соседних изменений) дает тот же документ: такие документы не отправляются
+    в elasticSearch повторно. Хеш сохраняется только после подтверждения загрузки и удаляется
+    вместе с документом. Без пути к файлу (db_path=None) все документы считаются измененными.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        if self.db_path is None:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS document_hash (
+                                      table_name TEXT NOT NULL,
+                                      id TEXT NOT NULL,
+                                      hash BLOB NOT NULL,
+                                      PRIMARY KEY (table_name, id)
+                                  ) WITHOUT ROWID""")
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def get_hash(doc: Document) -> bytes:
+        return hashlib.blake2b(doc.to_json().encode(), digest_size=16).digest()
+
+    def filter_changed(self, table: str, docs: List[Document]) -> Tuple[List[Document], Dict[str, bytes]]:
+        """
+        Функция отбирает документы, содержимое которых отличается от последней загруженной версии.
+
+        :return: измененные документы и их новые хеши, которые нужно сохранить после загрузки
+        """
+        if self.db_path is None:
+            return docs, {}
+        hashes = {str(doc.id): self.get_hash(doc) for doc in docs}
+        ids = list(hashes)
+        stored = {}
+        with closing(self.connect()) as connection:
+            for i in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                chunk = ids[i:i + SQLITE_MAX_VARIABLES]
+                stored.update(connection.execute(
+                    f"SELECT id, hash FROM document_hash WHERE table_name = ? AND id IN ({','.join('?' * len(chunk))})",
+                    (table, *chunk)))
+        changed = [doc for doc in docs if stored.get(str(doc.id)) != hashes[str(doc.id)]]
+        return changed, {str(doc.id): hashes[str(doc.id)] for doc in changed}
+
+    def store(self, table: str, hashes: Dict[str, bytes]) -> None:
+        """Функция запоминает хеши документов, загрузку которых подтвердил elasticSearch."""
+        if self.db_path is None or not hashes:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO document_hash (table_name, id, hash) VALUES (?, ?, ?)",
+                                   [(table, doc_id, doc_hash) for doc_id, doc_hash in hashes.items()])
+
+    def forget(self, table: str, ids: Iterable[str]) -> None:
+        """Функция удаляет хеши документов, удаленных из индекса."""
+        if self.db_path is None:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("DELETE FROM document_hash WHERE table_name = ? AND id = ?",
+                                   [(table, str(doc_id)) for doc_id in ids])
+
+    def clear(self, table: str) -> None:
+        """Функция удаляет все хеши таблицы, например после пересборки ее индекса с нуля."""
+        if self.db_path is None:
+            return
+        with closing(self.connect()) as connection, connection:
+            connection.execute("DELETE FROM document_hash WHERE table_name = ?", (table,))
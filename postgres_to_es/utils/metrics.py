@@ -0,0 +1,71 @@
+"""
+Метрики ETL в формате Prometheus.
+
+- etl_rows_total{stage, table} - сколько строк или документов прошло через стадию;
+- etl_stage_duration_seconds{stage, table} - время обработки одной пачки стадией;
+- etl_bulk_documents_total{table, result} - результат загрузки документов в elasticSearch
+  (indexed, skipped - не изменились, failed, deleted);
+- etl_bulk_errors_total{table, kind} - документы, отклоненные elasticSearch
+  (retryable - 429/5xx и отсутствие индекса, rejected - без повтора);
+- etl_crawl_watermark_timestamp_seconds{table} и etl_crawl_lag_seconds{table} - сохраненный
+  курсор updated_at таблицы и его отставание от текущего времени.
+"""
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable, Collection, Iterable, Iterator, List, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+STAGE_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+ROWS = Counter('etl_rows_total', 'Rows or documents processed by ETL stage', ['stage', 'table'])
+STAGE_SECONDS = Histogram('etl_stage_duration_seconds', 'Time spent by ETL stage on one batch', ['stage', 'table'],
+                          buckets=STAGE_BUCKETS)
+BULK_DOCUMENTS = Counter('etl_bulk_documents_total', 'Documents sent to elasticSearch by result', ['table', 'result'])
+BULK_ERRORS = Counter('etl_bulk_errors_total', 'Documents rejected by elasticSearch bulk API', ['table', 'kind'])
+CRAWL_WATERMARK = Gauge('etl_crawl_watermark_timestamp_seconds', 'Committed updated_at cursor of the table', ['table'])
+CRAWL_LAG = Gauge('etl_crawl_lag_seconds', 'How far the committed updated_at cursor is behind now', ['table'])
+
+
+def observe_batches(batches: Iterable[List], stage: str, table: str) -> Iterator[List]:
+    """
+    Генератор отдает пачки из batches и записывает время получения каждой пачки и ее размер.
+    Время обработки пачки ниже по цепочке в метрику стадии не попадает.
+    """
+    duration = STAGE_SECONDS.labels(stage, table)
+    rows = ROWS.labels(stage, table)
+    iterator = iter(batches)
+    while True:
+        started_at = perf_counter()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        duration.observe(perf_counter() - started_at)
+        rows.inc(len(batch))
+        yield batch
+
+
+def count_bulk_errors(table: str, retry_ids: Collection[str], rejected_ids: Collection[str]) -> None:
+    BULK_ERRORS.labels(table, 'retryable').inc(len(retry_ids))
+    BULK_ERRORS.labels(table, 'rejected').inc(len(rejected_ids))
+
+
+def watch_crawl_lag(tables: Iterable[str], get_cursor: Callable[[str], Tuple[datetime, str]]) -> None:
+    """
+    Функция регистрирует для таблиц метрики курсора, которые вычисляются в момент запроса метрик
+    из сохраненного состояния. Время курсора хранится со смещением.
+    """
+    for table in tables:
+        CRAWL_WATERMARK.labels(table).set_function(lambda table=table: _timestamp(get_cursor(table)[0]))
+        CRAWL_LAG.labels(table).set_function(
+            lambda table=table: (datetime.now(timezone.utc) - get_cursor(table)[0]).total_seconds())
+
+
+def _timestamp(value: datetime) -> float:
+    return value.timestamp()
+
+
+def start_metrics_server(port: int) -> None:
+    """Функция запускает HTTP-сервер метрик в отдельном потоке."""
+    start_http_server(port)
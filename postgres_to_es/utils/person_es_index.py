@@ -19,7 +19,7 @@ INDEX_PERSON_MAPPINGS = {
             "type": "text",
             "analyzer": "ru_en"
         },
-        "date": {
+        "birth_date": {
             "type": "date"
         },
         "film_ids": {
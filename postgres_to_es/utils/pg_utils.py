@@ -1,24 +1,161 @@
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator, Optional
+
 import psycopg2
+from psycopg2.extensions import connection as _connection
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 
-from config import POSTGRES_DSL
+from config import (POSTGRES_DSL, POSTGRES_POOL_MIN_SIZE, POSTGRES_POOL_MAX_SIZE, POSTGRES_POOL_HEALTH_CHECK_INTERVAL,
+                    POSTGRES_ITERSIZE)
 from utils.decorators import backoff
 
+# Ошибки соединения с Postgres: после них запрос можно повторить на новом соединении из пула.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
 
-class PostgresConnector:
 
-    def __init__(self):
-        self.connection = self.connect()
-        self.cursor = self.connection.cursor()
+class PostgresPool:
+    """
+    Пул соединений с Postgres, общий для всех стадий ETL.
+
+    Число одновременно выданных соединений ограничено max_size: если все соединения заняты,
+    getconn ждет освобождения, а не падает с PoolError. Перед выдачей соединение, простоявшее
+    дольше health_check_interval, проверяется запросом SELECT 1. Сломанные соединения закрываются
+    и не возвращаются в пул, поэтому повтор запроса через backoff получает уже новое соединение.
+    """
+
+    def __init__(self, min_size: int = POSTGRES_POOL_MIN_SIZE, max_size: int = POSTGRES_POOL_MAX_SIZE,
+                 health_check_interval: float = POSTGRES_POOL_HEALTH_CHECK_INTERVAL):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.pool = self.connect()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.last_used: Dict[int, float] = {}
 
     @backoff()
-    def connect(self):
-        return psycopg2.connect(**POSTGRES_DSL, cursor_factory=DictCursor)
+    def connect(self) -> ThreadedConnectionPool:
+        return ThreadedConnectionPool(self.min_size, self.max_size, **POSTGRES_DSL, cursor_factory=DictCursor)
+
+    def is_alive(self, conn: _connection) -> bool:
+        """Функция проверяет, что соединение не закрыто и отвечает на запросы."""
+        if conn.closed:
+            return False
+        if monotonic() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self) -> _connection:
+        """Функция выдает из пула живое соединение, при необходимости переподключаясь."""
+        self.slots.acquire()
+        try:
+            conn = self.pool.getconn()
+            while not self.is_alive(conn):
+                logging.warning("discard broken connection to postgres")
+                self.discard(conn)
+                conn = self.pool.getconn()
+            return conn
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn: _connection, close: bool = False) -> None:
+        """Функция возвращает соединение в пул. Сломанное соединение закрывается."""
+        try:
+            if close or conn.closed:
+                self.discard(conn)
+            else:
+                self.last_used[id(conn)] = monotonic()
+                self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def discard(self, conn: _connection) -> None:
+        self.last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер для временного получения соединения из пула."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def close(self) -> None:
+        self.pool.closeall()
+        self.last_used.clear()
+
+
+_pool: Optional[PostgresPool] = None
+_pool_pid: Optional[int] = None
+
+
+def get_pool() -> PostgresPool:
+    """
+    Функция возвращает общий для процесса пул соединений, создавая его при первом обращении.
+    Соединения нельзя разделять между процессами, поэтому после fork создается новый пул.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = PostgresPool()
+        _pool_pid = os.getpid()
+    return _pool
+
+
+class PostgresConnector:
+
+    def __init__(self, pool: Optional[PostgresPool] = None):
+        self._pool = pool
+
+    @property
+    def pool(self) -> PostgresPool:
+        """Пул соединений; по умолчанию общий пул процесса, который создается при первом запросе."""
+        return self._pool or get_pool()
 
     @backoff()
     def query(self, sql: str, args: tuple) -> list:
-        """Функция для декорированного запроса к БД."""
-        with self.connection as connection, connection.cursor() as cur:
-            cur.execute(sql, args)
-            rows = cur.fetchall()
+        """Функция для декорированного запроса к БД на соединении из пула."""
+        with self.pool.connection() as connection:
+            with connection, connection.cursor() as cur:
+                cur.execute(sql, args)
+                rows = cur.fetchall()
         return rows
+
+    def stream(self, sql: str, args: tuple, itersize: int = POSTGRES_ITERSIZE) -> Iterator[list]:
+        """
+        Функция лениво отдает строки результата запроса через именованный (серверный) курсор:
+        в память одновременно попадает не больше itersize строк, сколько бы их ни было.
+        Соединение занято, пока генератор не дочитан или не закрыт. Повторить запрос через
+        backoff после частично отданного результата нельзя, поэтому ошибки пробрасываются,
+        а повторяет всю пачку вызывающая стадия (см. merge и denormalize в ETL.py).
+        """
+        with self.pool.connection() as connection:
+            with connection, connection.cursor(name=f"etl_{uuid.uuid4().hex}") as cur:
+                cur.itersize = itersize
+                cur.execute(sql, args)
+                yield from cur
+
+    @backoff()
+    def execute(self, sql: str, args: tuple) -> int:
+        """Функция для декорированного запроса к БД, который не возвращает строк."""
+        with self.pool.connection() as connection:
+            with connection, connection.cursor() as cur:
+                cur.execute(sql, args)
+                return cur.rowcount
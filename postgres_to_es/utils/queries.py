@@ -0,0 +1,288 @@
+"""
+SQL-запросы ETL, общие для синхронного и асинхронного режимов.
+
+Пустые списки жанров и персоналий во всех режимах extract_mode и в документах
+content.film_work_document имеют одну форму: '{}' для массивов имен и '[]' для объектов,
+а не [null] или null.
+
+Параметры передаются в стиле psycopg2 (%s); списки id передаются массивом через
+= ANY(%s::uuid[]), чтобы те же запросы можно было выполнить и через asyncpg.
+"""
+
+CHANGED_ROWS_QUERY = '''
+    SELECT id, updated_at
+    FROM content.{table}
+    WHERE (updated_at, id) > (%s, %s)
+    ORDER BY updated_at, id
+    LIMIT %s;
+    '''
+
+PENDING_ROWS_QUERY = '''
+    SELECT count(*)
+    FROM (
+        SELECT 1
+        FROM content.{table}
+        WHERE (updated_at, id) > (%s, %s)
+        LIMIT %s
+    ) pending;
+    '''
+
+LINKED_FILMS_QUERY = '''
+    SELECT DISTINCT fw.id
+    FROM content.film_work fw
+    JOIN content.{table}_film_work rel ON rel.film_work_id = fw.id
+    WHERE rel.{table}_id = ANY(%s::uuid[]) AND fw.id > %s
+    ORDER BY fw.id
+    LIMIT %s;
+    '''
+
+FILMS_QUERY = '''
+    SELECT
+        fw.id,
+        fw.rating,
+        fw.type,
+        fw.title,
+        fw.description,
+        fw.creation_date,
+        COALESCE(ARRAY_AGG(DISTINCT g.name) FILTER (WHERE g.name IS NOT NULL), '{}') AS genres_names,
+        COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director'), '{}') AS directors_names,
+        COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor'), '{}') AS actors_names,
+        COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer'), '{}') AS writers_names,
+        COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name))
+        FILTER (WHERE g.id IS NOT NULL), '[]') AS genres,
+        COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'director'), '[]') AS directors,
+        COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'actor'), '[]') AS actors,
+        COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'writer'), '[]') AS writers
+    FROM content.film_work fw
+    LEFT OUTER JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT OUTER JOIN content.person p ON p.id = pfw.person_id
+    LEFT OUTER JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT OUTER JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE fw.id = ANY(%s::uuid[])
+    GROUP BY fw.id, fw.title, fw.description, fw.creation_date, fw.rating;
+    '''
+
+GENRES_QUERY = '''
+    SELECT DISTINCT id, name, description
+    FROM content.genre g
+    WHERE g.id = ANY(%s::uuid[]);
+    '''
+
+PERSONS_QUERY = '''
+    SELECT DISTINCT
+        p.id,
+        p.full_name,
+        COALESCE(ARRAY_AGG(DISTINCT pfw.role) FILTER (WHERE pfw.role IS NOT NULL), '{}') AS roles,
+        p.birth_date,
+        COALESCE(ARRAY_AGG(DISTINCT pfw.film_work_id::text) FILTER (WHERE pfw.film_work_id IS NOT NULL), '{}')
+        AS film_ids
+    FROM content.person p
+    LEFT OUTER JOIN content.person_film_work pfw ON p.id = pfw.person_id
+    WHERE p.id = ANY(%s::uuid[])
+    GROUP BY p.id;
+    '''
+
+FILM_IDS_RANGE_QUERY = '''
+    SELECT id
+    FROM content.film_work
+    WHERE id BETWEEN %s AND %s
+    ORDER BY id
+    LIMIT %s;
+    '''
+
+FILMS_RANGE_COUNT_QUERY = '''
+    SELECT count(*)
+    FROM content.film_work
+    WHERE id BETWEEN %s AND %s;
+    '''
+
+# Кинопроизведения, документы которых могли измениться с момента %s: сам фильм, его жанры
+# и персоналии, новые связи. Удаленные связи видны только в журнале изменений.
+CHANGED_FILMS_SINCE_QUERY = '''
+    SELECT id FROM content.film_work WHERE updated_at >= %s
+    UNION
+    SELECT gfw.film_work_id
+    FROM content.genre_film_work gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE g.updated_at >= %s
+    UNION
+    SELECT pfw.film_work_id
+    FROM content.person_film_work pfw
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE p.updated_at >= %s
+    UNION
+    SELECT film_work_id FROM content.genre_film_work WHERE created_at >= %s
+    UNION
+    SELECT film_work_id FROM content.person_film_work WHERE created_at >= %s;
+    '''
+
+# В режиме stored любое изменение документа, в том числе удаление связи, меняет его updated_at.
+STORED_CHANGED_FILMS_SINCE_QUERY = '''
+    SELECT id FROM content.film_work_document WHERE updated_at >= %s;
+    '''
+
+CHANGE_FEED_EXISTS_QUERY = '''
+    SELECT to_regclass('content.change_feed_settings') IS NOT NULL;
+    '''
+
+# Триггеры журнала изменений пишут в него, только пока ETL включил журнал, и уведомляют
+# об изменениях в канал из настроек.
+CHANGE_FEED_SETTINGS_QUERY = '''
+    UPDATE content.change_feed_settings
+    SET enabled = %s, channel = %s;
+    '''
+
+CLEAR_CHANGES_QUERY = '''
+    DELETE FROM content.change_log;
+    '''
+
+NOW_QUERY = '''
+    SELECT now();
+    '''
+
+CHANGES_QUERY = '''
+    SELECT id, table_name, operation, object_id, film_work_id
+    FROM content.change_log
+    ORDER BY id
+    LIMIT %s;
+    '''
+
+PURGE_CHANGES_QUERY = '''
+    DELETE FROM content.change_log
+    WHERE id = ANY(%s::bigint[]);
+    '''
+
+FILM_DOCUMENT = '''
+    jsonb_build_object(
+        'id', fw.id,
+        'rating', fw.rating,
+        'type', fw.type,
+        'title', fw.title,
+        'description', fw.description,
+        'creation_date', fw.creation_date,
+        'genres_names', COALESCE(ARRAY_AGG(DISTINCT g.name) FILTER (WHERE g.name IS NOT NULL), '{}'),
+        'directors_names', COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director'), '{}'),
+        'actors_names', COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor'), '{}'),
+        'writers_names', COALESCE(ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer'), '{}'),
+        'genres', COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name))
+        FILTER (WHERE g.id IS NOT NULL), '[]'),
+        'directors', COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'director'), '[]'),
+        'actors', COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'actor'), '[]'),
+        'writers', COALESCE(JSON_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+        FILTER (WHERE pfw.role = 'writer'), '[]')
+    )'''
+
+FILM_DOCUMENT_JOINS = '''
+    LEFT OUTER JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT OUTER JOIN content.person p ON p.id = pfw.person_id
+    LEFT OUTER JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT OUTER JOIN content.genre g ON g.id = gfw.genre_id'''
+
+GENRE_DOCUMENT = '''
+    jsonb_build_object(
+        'id', g.id,
+        'name', g.name,
+        'description', g.description
+    )'''
+
+PERSON_DOCUMENT = '''
+    jsonb_build_object(
+        'id', p.id,
+        'full_name', p.full_name,
+        'roles', COALESCE(ARRAY_AGG(DISTINCT pfw.role) FILTER (WHERE pfw.role IS NOT NULL), '{}'),
+        'birth_date', p.birth_date,
+        'film_ids', COALESCE(ARRAY_AGG(DISTINCT pfw.film_work_id::text) FILTER (WHERE pfw.film_work_id IS NOT NULL),
+                             '{}')
+    )'''
+
+
+def _denormalize_queries(cast: str = '') -> dict:
+    """
+    Одним запросом для пачки измененных жанров или персоналий собираются id связанных
+    кинопроизведений и документы самих жанров или персоналий. Документы кинопроизведений
+    здесь не собираются: их id проходят через накопитель и собираются вместе с остальными
+    измененными фильмами без повторов. Строки результата: (kind, id, doc), у фильмов doc - NULL.
+
+    :param cast: приведение документов, '::text' - готовый JSON-текст
+    """
+    films = f'''
+            SELECT 'film_work' AS kind, films.id, NULL::jsonb{cast} AS doc
+            FROM films'''
+    return {
+        'genre': f'''
+            WITH films AS (
+                SELECT DISTINCT film_work_id AS id
+                FROM content.genre_film_work
+                WHERE genre_id = ANY(%s::uuid[])
+            )
+            {films}
+            UNION ALL
+            SELECT 'genre' AS kind, g.id, {GENRE_DOCUMENT}{cast} AS doc
+            FROM content.genre g
+            WHERE g.id = ANY(%s::uuid[]);
+            ''',
+        'person': f'''
+            WITH films AS (
+                SELECT DISTINCT film_work_id AS id
+                FROM content.person_film_work
+                WHERE person_id = ANY(%s::uuid[])
+            )
+            {films}
+            UNION ALL
+            SELECT 'person' AS kind, p.id, {PERSON_DOCUMENT}{cast} AS doc
+            FROM content.person p
+            LEFT OUTER JOIN content.person_film_work pfw ON p.id = pfw.person_id
+            WHERE p.id = ANY(%s::uuid[])
+            GROUP BY p.id;
+            ''',
+    }
+
+
+DENORMALIZE_QUERIES = _denormalize_queries()
+
+# Режим extract_mode = raw: документ возвращается из БД готовым JSON-текстом и без разбора
+# копируется в тело bulk-запроса.
+RAW_DENORMALIZE_QUERIES = _denormalize_queries('::text')
+
+RAW_DOCUMENT_QUERIES = {
+    'film_work': f'''
+        SELECT fw.id, {FILM_DOCUMENT}::text AS doc
+        FROM content.film_work fw
+        {FILM_DOCUMENT_JOINS}
+        WHERE fw.id = ANY(%s::uuid[])
+        GROUP BY fw.id;
+        ''',
+    'genre': f'''
+        SELECT g.id, {GENRE_DOCUMENT}::text AS doc
+        FROM content.genre g
+        WHERE g.id = ANY(%s::uuid[]);
+        ''',
+    'person': f'''
+        SELECT p.id, {PERSON_DOCUMENT}::text AS doc
+        FROM content.person p
+        LEFT OUTER JOIN content.person_film_work pfw ON p.id = pfw.person_id
+        WHERE p.id = ANY(%s::uuid[])
+        GROUP BY p.id;
+        ''',
+}
+
+# Режим extract_mode = stored: документы кинопроизведений читаются готовыми из таблицы
+# content.film_work_document (etc/db/db_schema_film_document.sql), которую поддерживают триггеры, -
+# одна строка по первичному ключу вместо соединения пяти таблиц. Жанры и персоналии - как в raw.
+# В режиме stored изменения кинопроизведений ищутся по updated_at готовых документов: он меняется
+# и при изменении только связей с жанрами и персоналиями, которое film_work.updated_at не трогает.
+STORED_POLL_TABLES = {'film_work': 'film_work_document'}
+
+STORED_DOCUMENT_QUERIES = {
+    **RAW_DOCUMENT_QUERIES,
+    'film_work': '''
+        SELECT id, document::text AS doc
+        FROM content.film_work_document
+        WHERE id = ANY(%s::uuid[]);
+        ''',
+}
@@ -0,0 +1,82 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, Sequence
+
+from utils.dataclasses_etl import FilmWork, FilmWorkPerson, FilmWorkGenre, Genre, Person, RawDocument
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Функция лениво делит поток элементов на списки не длиннее size."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_film_work(film: Sequence) -> FilmWork:
+    """Функция собирает кинопроизведение из строки результата FILMS_QUERY."""
+    return FilmWork(
+        id=film[0],
+        rating=film[1],
+        type=film[2],
+        title=film[3],
+        description=film[4],
+        creation_date=film[5],
+        genres_names=film[6],
+        directors_names=film[7],
+        actors_names=film[8],
+        writers_names=film[9],
+        genres=[FilmWorkGenre(**genre) for genre in film[10]] if film[10] else [],
+        directors=[FilmWorkPerson(**person) for person in film[11]] if film[11] else [],
+        actors=[FilmWorkPerson(**person) for person in film[12]] if film[12] else [],
+        writers=[FilmWorkPerson(**person) for person in film[13]] if film[13] else [])
+
+
+def to_genre(genre: Sequence) -> Genre:
+    """Функция собирает жанр из строки результата GENRES_QUERY."""
+    return Genre(
+        id=genre[0],
+        name=genre[1],
+        description=genre[2])
+
+
+def to_person(person: Sequence) -> Person:
+    """Функция собирает персоналию из строки результата PERSONS_QUERY."""
+    return Person(
+        id=person[0],
+        full_name=person[1],
+        roles=person[2],
+        birth_date=person[3],
+        film_ids=person[4])
+
+
+def to_raw_document(row: Sequence) -> RawDocument:
+    """Функция оборачивает строку (id, doc::text) в документ без разбора JSON."""
+    return RawDocument(id=row[0], source=row[1])
+
+
+def film_work_from_document(doc: dict) -> FilmWork:
+    """Функция собирает кинопроизведение из JSON-документа FILM_DOCUMENT."""
+    return FilmWork(
+        id=doc['id'],
+        rating=doc['rating'],
+        type=doc['type'],
+        title=doc['title'],
+        description=doc['description'],
+        creation_date=doc.get('creation_date'),
+        genres_names=doc['genres_names'],
+        directors_names=doc['directors_names'],
+        actors_names=doc['actors_names'],
+        writers_names=doc['writers_names'],
+        genres=[FilmWorkGenre(**genre) for genre in doc['genres']] if doc['genres'] else [],
+        directors=[FilmWorkPerson(**person) for person in doc['directors']] if doc['directors'] else [],
+        actors=[FilmWorkPerson(**person) for person in doc['actors']] if doc['actors'] else [],
+        writers=[FilmWorkPerson(**person) for person in doc['writers']] if doc['writers'] else [])
+
+
+DOCUMENT_TRANSFORMS = {
+    'film_work': film_work_from_document,
+    'genre': lambda doc: Genre(**doc),
+    'person': lambda doc: Person(**doc),
+}